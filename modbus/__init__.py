@@ -2,16 +2,30 @@
 
 import argparse
 import sys
+import signal
 import os
+import time
 import logging
 import urllib.parse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import colorama as clr
 
-from modbus_cli.definitions import Definitions
+from modbus_cli.definitions import Definitions, default_cache_dir, parse_deadband, parse_period
 from modbus_cli.modbus_rtu import ModbusRtu
 from modbus_cli.modbus_tcp import ModbusTcp
-from modbus_cli.access import parse_accesses
+from modbus_cli.access import parse_accesses, group_accesses
+from modbus_cli.target import Target, parse_targets, perform_targets
+from modbus_cli.bulk_write import write_from
+from modbus_cli.output import LogOutput, RecordOutput, Changes, FORMATS
+from modbus_cli.scheduler import Scheduler, scan_periods
+from modbus_cli.server import Server, make_request, query
+from modbus_cli.stats import Stats
+from modbus_cli.retry import CircuitBreaker
+from modbus_cli.rtt import Rtt
+from modbus_cli.arrays import ArrayOutput, FORMATS as ARRAY_FORMATS, import_numpy, plan_dtype
+from modbus_cli.capture import Capture, describe, replay
 
 
 class ColourHandler(logging.Handler):
@@ -36,10 +50,12 @@ class ColourHandler(logging.Handler):
         print(msg)
 
 
-def connect_to_device(args):
-    if args.device[0] == "/":
+def make_transport(args, device=None, stats=None, rtt=None):
+    device = device or args.device
+
+    if device[0] == "/":
         modbus = ModbusRtu(
-            device=args.device,
+            device=device,
             baud=args.baud,
             parity=args.parity,
             stop_bits=args.stop_bits,
@@ -48,20 +64,248 @@ def connect_to_device(args):
         )
     else:
         try:
-            result = urllib.parse.urlsplit("//" + args.device)
+            result = urllib.parse.urlsplit("//" + device)
             host = result.hostname or "localhost"
             port = result.port or 502
         except ValueError:
-            logging.error("Invalid device %r", args.device)
-            sys.exit(1)
+            raise ValueError("Invalid device {!r}".format(device)) from None
+
+        modbus = ModbusTcp(host, port, args.slave_id, args.timeout, args.window)
+
+    modbus.stats = stats
+    modbus.rtt = rtt
+    modbus.retries = args.retries
+    modbus.backoff = args.backoff
+
+    return modbus
 
-        modbus = ModbusTcp(host, port, args.slave_id, args.timeout)
 
+def connect_to_device(args, device=None, stats=None, rtt=None):
+    modbus = make_transport(args, device, stats, rtt)
     modbus.connect()
 
     return modbus
 
 
+def poll(cycle, interval, count=None, stop=None):
+    # Cycles are scheduled relative to the start time, not to the end of the
+    # previous cycle, so that the period doesn't drift. A cycle that overruns
+    # skips the ticks it missed instead of running the next ones back to back.
+    start = time.monotonic()
+    tick = 0
+    cycles = 0
+
+    while True:
+        cycle()
+
+        cycles += 1
+        if count is not None and cycles >= count:
+            break
+
+        next_tick = max(tick + 1, int((time.monotonic() - start) / interval) + 1)
+        if next_tick > tick + 1:
+            logging.warning('Polling cycle took too long, skipped %d cycle(s)', next_tick - tick - 1)
+        tick = next_tick
+
+        delay = max(0, start + tick * interval - time.monotonic())
+        if stop is None:
+            time.sleep(delay)
+        elif stop.wait(delay):
+            break
+
+
+def scan(args, targets, definitions, output, tagged=False, stop=None, stats=None, rtt=None):
+    """Connect to the targets and perform their accesses, once or polling
+
+    All the targets are on the same device, or on the same serial port.
+    Returns whether they never failed, see perform_targets."""
+    modbus = None
+    failed = False
+
+    try:
+        modbus = make_transport(args, targets[0].device, stats, rtt)
+        try:
+            modbus.connect()
+        except OSError as e:
+            if not args.poll:
+                raise
+            # keep polling, the connection will be retried
+            logging.error('%s: %s', ', '.join(target.tag for target in targets), e)
+            modbus.broken = True
+        modbus.output = output
+        for target in targets:
+            target.modbus = modbus
+            if target.slave_id is None:
+                target.slave_id = modbus.slave_id
+
+        def cycle():
+            nonlocal failed
+            if perform_targets(targets, definitions, bool(args.poll)):
+                failed = True
+            output.flush()
+
+        if args.poll:
+            poll(cycle, args.poll, args.count, stop)
+        else:
+            cycle()
+    except Exception as e:
+        if not tagged:
+            raise
+        # the other devices go on
+        logging.error('%s: %s', ', '.join(target.tag for target in targets), e)
+        failed = True
+    finally:
+        if modbus:
+            modbus.close()
+        for target in targets:
+            if target.scheduler:
+                target.scheduler.report(target.tag if tagged else None)
+
+    return not failed
+
+
+def scan_pattern(s):
+    pattern, _, period = s.rpartition("=")
+    if not pattern:
+        raise argparse.ArgumentTypeError("expected PATTERN=PERIOD")
+    return pattern, parse_period(period)
+
+
+def make_target(args, definitions, device, slave_id, accesses):
+    if not args.poll:
+        return Target(device, slave_id,
+                      parse_accesses(accesses, definitions, args.byte_order, args.silent, args.max_gap))
+
+    if args.capture:
+        # a single plan, as short as possible
+        target = Target(device, slave_id,
+                        parse_accesses(accesses, definitions, args.byte_order, args.silent, args.max_gap))
+    else:
+        target = make_polled_target(args, definitions, device, slave_id, accesses)
+    if args.down_after:
+        target.breaker = CircuitBreaker(args.down_after, args.down_for)
+
+    return target
+
+
+def make_polled_target(args, definitions, device, slave_id, accesses):
+    accesses = parse_accesses(accesses, definitions, args.byte_order, args.silent, group=False)
+    periods = scan_periods(accesses, definitions, args.poll, args.scan)
+
+    if len(periods) == 1 and args.poll in periods:
+        # everything at the polling interval, a single plan will do
+        return Target(device, slave_id, group_accesses(accesses, args.max_gap))
+
+    target = Target(device, slave_id, [])
+    target.scheduler = Scheduler(periods, args.poll, args.max_gap, target.illegal_gaps)
+
+    return target
+
+
+def make_output(args, definitions, tagged):
+    changes = Changes(definitions, args.deadband) if args.changes else None
+
+    if args.format in ARRAY_FORMATS:
+        return ArrayOutput(sys.stdout.buffer, args.format)
+    elif args.format:
+        return RecordOutput(sys.stdout, args.format, changes)
+    else:
+        return LogOutput(tagged, changes)
+
+
+def target_specs(args):
+    """The device, slave id and accesses of each target"""
+    if args.targets:
+        return parse_targets(args.targets)
+    else:
+        return [(device, args.slave_id, args.access) for device in args.device.split(",")]
+
+
+def run(args, definitions, stats=None, rtt=None):
+    """Do what the command line asks for, returning whether it succeeded"""
+    if args.decode:
+        try:
+            replay(args.decode, definitions, lambda tagged: make_output(args, definitions, tagged))
+        except (OSError, ValueError) as e:
+            logging.error("Can't decode %s: %s", args.decode, e)
+            sys.exit(1)
+        return True
+
+    if args.serve:
+        # stop as for ^C, removing the socket
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        with Server(args.serve, lambda device: connect_to_device(args, device, stats, rtt), definitions) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        return True
+
+    if args.write_from:
+        modbus = connect_to_device(args, stats=stats, rtt=rtt)
+        try:
+            if args.write_from == "-":
+                _, _, rejected = write_from(modbus, sys.stdin, definitions, args.byte_order, args.silent)
+            else:
+                with open(args.write_from) as f:
+                    _, _, rejected = write_from(modbus, f, definitions, args.byte_order, args.silent)
+        finally:
+            modbus.close()
+        return not rejected
+
+    specs = target_specs(args)
+
+    if stats:
+        start = time.perf_counter()
+
+    targets = [make_target(args, definitions, *spec) for spec in specs]
+
+    if stats:
+        stats.add_time('plan', start)
+
+    # targets on the same serial port take turns on one connection, all
+    # the others run concurrently on their own connection
+    groups = {}
+    for target in targets:
+        groups.setdefault(target.device if target.serial else id(target), []).append(target)
+    groups = list(groups.values())
+
+    tagged = len(targets) > 1
+
+    if args.capture:
+        registers = [describe(parse_accesses(accesses, definitions, args.byte_order, args.silent, group=False))
+                     for _, _, accesses in specs]
+        output = Capture(args.capture, args.capture_size, [(target.tag, r) for target, r in zip(targets, registers)],
+                         args.byte_order, args.silent)
+    else:
+        output = make_output(args, definitions, tagged)
+
+    try:
+        return scan_groups(args, groups, definitions, output, tagged, stats, rtt)
+    finally:
+        if args.capture:
+            output.close()
+
+
+def scan_groups(args, groups, definitions, output, tagged, stats=None, rtt=None):
+    """Scan the groups of targets concurrently, returning whether none of them failed"""
+    if len(groups) == 1:
+        try:
+            return scan(args, groups[0], definitions, output, tagged, stats=stats, rtt=rtt)
+        except KeyboardInterrupt:
+            return True
+    else:
+        stop = threading.Event()
+        with ThreadPoolExecutor(len(groups)) as pool:
+            futures = [pool.submit(scan, args, group, definitions, output, tagged, stop, stats, rtt)
+                       for group in groups]
+            try:
+                return all([future.result() for future in futures])
+            except KeyboardInterrupt:
+                stop.set()
+                return True
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-r", "--registers", action="append", default=[])
@@ -75,11 +319,81 @@ def main():
     parser.add_argument(
         "-B", "--byte-order", choices=["le", "be", "mixed"], default="be"
     )
-    parser.add_argument("device")
-    parser.add_argument("access", nargs="+")
+    parser.add_argument("--poll", type=float, metavar="INTERVAL")
+    parser.add_argument("--count", type=int, metavar="N")
+    parser.add_argument("--max-gap", type=int, default=0, metavar="N")
+    parser.add_argument("-w", "--window", type=int, metavar="N")
+    parser.add_argument("-T", "--targets", metavar="FILE")
+    parser.add_argument("--write-from", metavar="FILE")
+    parser.add_argument("-f", "--format", choices=sorted(FORMATS) + list(ARRAY_FORMATS))
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("-c", "--changes", action="store_true")
+    parser.add_argument("--deadband", type=parse_deadband)
+    parser.add_argument("--scan", type=scan_pattern, action="append", default=[], metavar="PATTERN=PERIOD")
+    parser.add_argument("--serve", metavar="SOCKET")
+    parser.add_argument("--via", metavar="SOCKET")
+    parser.add_argument("--retries", type=int, default=0, metavar="N")
+    parser.add_argument("--backoff", type=float, default=0.1, metavar="SECONDS")
+    parser.add_argument("--down-after", type=int, default=3, metavar="N")
+    parser.add_argument("--down-for", type=float, default=60, metavar="SECONDS")
+    parser.add_argument("--adaptive-timeout", action="store_true")
+    parser.add_argument("--min-timeout", type=float, default=0.05, metavar="SECONDS")
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--stats-file", metavar="FILE")
+    parser.add_argument("--capture", metavar="FILE")
+    parser.add_argument("--capture-size", type=int, default=100000, metavar="N")
+    parser.add_argument("--decode", metavar="FILE")
+    parser.add_argument("device", nargs="?")
+    parser.add_argument("access", nargs="*")
     args = parser.parse_args()
 
-    clr.init()
+    if args.decode:
+        if args.device or args.targets or args.serve or args.write_from or args.via or args.capture:
+            parser.error("--decode can't be used with devices and accesses, --targets, --serve, --write-from, "
+                         "--via or --capture")
+    elif args.serve:
+        if args.device:
+            parser.error("devices and accesses can't be given together with --serve")
+    elif args.targets:
+        if args.device:
+            parser.error("devices and accesses can't be given together with --targets")
+    elif args.write_from:
+        if not args.device or args.access:
+            parser.error("--write-from requires a device and no accesses")
+    elif not args.device or not args.access:
+        parser.error("the following arguments are required: device, access")
+
+    if args.count is not None and not args.poll:
+        parser.error("--count requires --poll")
+
+    if args.format in ARRAY_FORMATS:
+        if args.changes or args.via or args.serve:
+            parser.error("--format {} can't be used with --changes, --via or --serve".format(args.format))
+        try:
+            import_numpy()
+        except ImportError as e:
+            parser.error(str(e))
+
+    if args.capture:
+        if args.format or args.changes or args.via or args.serve or args.write_from:
+            parser.error("--capture can't be used with --format, --changes, --via, --serve or --write-from")
+        if args.capture_size < 1:
+            parser.error("--capture-size must be at least 1")
+
+    if args.via:
+        if args.targets or args.write_from or args.poll:
+            parser.error("--via can't be used with --targets, --write-from or --poll")
+        try:
+            answer = query(args.via, make_request(args))
+        except OSError as e:
+            parser.exit(1, "can't reach the server on {}: {}\n".format(args.via, e))
+        sys.stdout.write(answer)
+        if any(line.startswith("error: ") for line in answer.splitlines()):
+            sys.exit(1)
+        return
+
+    if not args.format:
+        clr.init()
 
     try:
         mainLogger = logging.getLogger()  # Main logger
@@ -89,22 +403,55 @@ def main():
         else:
             mainLogger.setLevel(logging.INFO)
 
-        ch = ColourHandler()
-        mainLogger.addHandler(ch)
+        if args.format:
+            # stdout is for the records, keep the log out of the way
+            mainLogger.addHandler(logging.StreamHandler())
+        else:
+            ch = ColourHandler()
+            mainLogger.addHandler(ch)
 
-        definitions = Definitions(args.silent)
+        definitions = Definitions(args.silent, None if args.no_cache else default_cache_dir())
         definitions.parse(
             args.registers + os.environ.get("MODBUS_DEFINITIONS", "").split(":")
         )
 
-        connect_to_device(args).perform_accesses(
-            parse_accesses(args.access, definitions, args.byte_order, args.silent),
-            definitions,
-        ).close()
+        if args.format in ARRAY_FORMATS and not args.decode:
+            # all the values of a cycle make up a single array
+            try:
+                plan_dtype(access for _, _, accesses in target_specs(args)
+                           for access in parse_accesses(accesses, definitions, args.byte_order, args.silent,
+                                                        group=False))
+            except ValueError as e:
+                parser.error(str(e))
+
+        stats = Stats() if args.stats or args.stats_file else None
+
+        rtt = None
+        if args.adaptive_timeout:
+            rtt = Rtt(args.min_timeout, args.timeout)
+            rtt_file = None if args.no_cache else os.path.join(default_cache_dir(), "response_times.json")
+            if rtt_file:
+                rtt.load(rtt_file)
+
+        try:
+            ok = run(args, definitions, stats, rtt)
+        except ValueError as e:
+            # e.g. an invalid device or access
+            logging.error("%s", e)
+            sys.exit(1)
+        finally:
+            if rtt and rtt_file:
+                rtt.save(rtt_file)
+            if args.stats:
+                stats.report()
+            if args.stats_file:
+                stats.dump(args.stats_file)
+
+        if not ok:
+            sys.exit(1)
 
     finally:
         # restore stdout/stderr if colorama has modified them (mostly on windows)
         # Leaving this out doesn't seem to hurt anything, but they say to call deinit, so we call deinit.
-        clr.deinit()
-
-
+        if not args.format:
+            clr.deinit()
@@ -1,26 +1,72 @@
+import sys
 import struct
-from itertools import zip_longest, groupby
+from itertools import groupby
+from functools import lru_cache
 import logging
 import re
-import fnmatch
+import time
 
 import umodbus.exceptions
 
-from .definitions import REGISTER_RE
+from .definitions import REGISTER_RE, parse_register
 
+# Maximum number of coils or registers in a single request, by modbus type and
+# direction, as per the Modbus application protocol specification
+MAX_QUANTITY = {
+    ('c', False): 2000,  # read coils
+    ('C', False): 2000,
+    ('d', False): 2000,  # read discrete inputs
+    ('h', False): 125,   # read holding registers
+    ('H', False): 125,
+    ('i', False): 125,   # read input registers
+    ('c', True): 1968,   # write multiple coils
+    ('C', True): 1968,
+    ('h', True): 123,    # write multiple registers
+    ('H', True): 123,
+}
 
-def grouper(iterable, n, fillvalue=None):
-    'Collect data into fixed-length chunks or blocks'
-    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
-    args = [iter(iterable)] * n
-    return zip_longest(*args, fillvalue=fillvalue)
+REPEATED_PACK_TYPE_RE = re.compile(r'^([@=<>!]?)(\d+)(\D)$')
 
 
 def dump(xs):
     return ' '.join('{:02x}'.format(x) for x in xs)
 
 
+def error_message(e):
+    # some umodbus exceptions only have a repr, others are their docstring
+    return ' '.join(str(e).split()) or type(e).__name__
+
+
+def gap_pack_type(modbus_type, n):
+    """Pack type skipping n unrequested registers or coils"""
+    if modbus_type in 'cCd':
+        return '{}x'.format(n)
+    else:
+        return '{}x'.format(2 * n)
+
+
+@lru_cache(maxsize=None)
+def register_count(modbus_type, pack_type):
+    """Number of registers or coils spanned by pack_type"""
+    size = struct.calcsize(pack_type)
+    if modbus_type in ('h', 'H', 'i'):
+        assert size % 2 == 0
+        size //= 2
+
+    return size
+
+
+def is_gap(pack_type):
+    # Parsed pack types always start with a byte order, gaps never do
+    return pack_type[0] not in '@=<>!'
+
+
 class Access:
+    # plans can contain tens of thousands of accesses before grouping
+    __slots__ = ('modbus_type', 'values_to_write', 'addresses', 'pack_types', 'names', 'presenters',
+                 'byte_order', 'silent', 'write', 'n_registers', 'decoder', 'encoded',
+                 'request', 'words', 'values', 'error')
+
     def __init__(self, modbus_type, addresses, pack_types, values=None, names=None, presenters=None, byte_order='be', silent=False):
         self.modbus_type = modbus_type
         self.values_to_write = values or [None] * len(addresses)
@@ -30,6 +76,19 @@ class Access:
         self.presenters = presenters or [None] * len(addresses)
         self.byte_order = byte_order
         self.silent = silent
+        self.write = any(x is not None for x in self.values_to_write)
+        self.n_registers = sum(register_count(modbus_type, p) for p in pack_types)
+        # see compile_decoder and encode_values
+        self.decoder = None
+        self.encoded = None
+        self.request = None
+        self.words = ()
+        self.values = ()
+        self.error = None
+
+    def copy(self):
+        return Access(self.modbus_type, list(self.addresses), list(self.pack_types), list(self.values_to_write),
+                      list(self.names), list(self.presenters), self.byte_order, self.silent)
 
     def address(self):
         return self.addresses[0]
@@ -43,22 +102,13 @@ class Access:
     def endianness(self):
         return self.pack_type()[0]
 
-    @property
-    def write(self):
-        return any(x is not None for x in self.values_to_write)
-
     def size(self):
         """Number of registers"""
-        total = 0
-        for p in self.pack_types:
-            size = struct.calcsize(p)
-            if self.modbus_type in ('h', 'H', 'i'):
-                assert size % 2 == 0
-                size //= 2
+        return self.n_registers
 
-            total += size
-
-        return total
+    def max_size(self):
+        """Maximum number of registers that can be accessed in one request"""
+        return MAX_QUANTITY[(self.modbus_type, self.write)]
 
     def operations(self):
         if self.write:
@@ -67,24 +117,98 @@ class Access:
             return self.pack_types
 
     def append(self, other):
+        self.decoder = None
+        self.encoded = None
         self.names.extend(other.names)
         self.pack_types.extend(other.pack_types)
         self.addresses.extend(other.addresses)
         self.presenters.extend(other.presenters)
         if self.write:
             self.values_to_write.extend(other.values_to_write)
+        self.n_registers += other.n_registers
+
+    def append_gap(self, n):
+        """Extend the access over n registers that are read and then discarded"""
+        self.decoder = None
+        self.names.append(None)
+        self.addresses.append(self.address() + self.size())
+        self.pack_types.append(gap_pack_type(self.modbus_type, n))
+        self.presenters.append(None)
+        self.n_registers += n
+
+    def gaps(self):
+        """Addresses of the registers read only to bridge gaps"""
+        for address, pack_type in zip(self.addresses, self.pack_types):
+            if is_gap(pack_type):
+                yield from range(address, address + register_count(self.modbus_type, pack_type))
+
+    def split_gaps(self):
+        """Split the access where it bridges gaps, dropping the gaps"""
+        parts = []
+        for name, address, pack_type, presenter in zip(self.names, self.addresses, self.pack_types, self.presenters):
+            if is_gap(pack_type):
+                parts.append(None)
+                continue
+
+            access = Access(self.modbus_type, [address], [pack_type], names=[name], presenters=[presenter],
+                            byte_order=self.byte_order, silent=self.silent)
+            if parts and parts[-1] is not None:
+                parts[-1].append(access)
+            else:
+                parts.append(access)
+
+        return [part for part in parts if part is not None]
 
     def labels(self):
         return (name or address for (name, address) in zip(self.names, self.addresses))
 
-    def print_values(self, definitions=None):
-        for label, value, presenter in zip(self.labels(), self.values, self.presenters):
+    def print_values(self, definitions=None, tag=None, changed=None):
+        """Log the values read, only those for which changed(label, value) is true if given"""
+        prefix = '{} '.format(tag) if tag else ''
+
+        for line in self.format_values(definitions, changed):
+            logging.info('{}{}'.format(prefix, line))
+
+    def format_values(self, definitions=None, changed=None):
+        """Describe the values read, one line each"""
+        if self.values is None:
+            # retried without bridging the gaps, see unbridge_illegal_gaps
+            return
+
+        for label, value, presenter, pack_type in zip(self.labels(), self.values, self.presenters, self.pack_types):
+            if is_gap(pack_type):
+                continue
             if len(value) == 1:
                 value = value[0]
+            if changed and not changed(label, value):
+                continue
             if self.silent:
-                logging.info('{}'.format(value))
+                yield '{}'.format(value)
+            else:
+                yield '{}: {} {}'.format(label, value, self.present_value(value, presenter, definitions))
+
+    def records(self):
+        """The label, raw registers (or coils) and value of each value read"""
+        if self.values is None:
+            return
+
+        _, words_struct, decoded = self.decoder or self.compile_decoder()
+
+        for label, value, pack_type, how in zip(self.labels(), self.values, self.pack_types, decoded):
+            if is_gap(pack_type):
+                continue
+
+            if words_struct is None:
+                offset, size, _ = how
+                words = self.words[offset:offset + size]
             else:
-                logging.info('{}: {} {}'.format(label, value, self.present_value(value, presenter, definitions)))
+                value_struct, offset = how
+                words = self.words[offset // 2:(offset + value_struct.size + 1) // 2]
+
+            if len(value) == 1:
+                value = value[0]
+
+            yield label, list(words), value
 
     def present_value(self, value, presenter, definitions):
         if type(value) != int:
@@ -112,19 +236,43 @@ class Access:
             self.read_registers_send(modbus)
             self.read_registers_receive(modbus)
 
-    def read_registers_send(self, modbus):
+    def compile_decoder(self):
+        """Precompute what's needed to decode the responses to this access
+
+        For coils it's the number of coils and the offset of each value, for
+        registers a struct to turn the registers back into the bytes they
+        were read from, and a struct and byte offset for each value."""
+        offset = 0
+        values = []
+
         if self.modbus_type in 'cCd':
-            n_registers = 0
-            for pack_type in self.pack_types:
-                n_registers += struct.calcsize(pack_type)
+            for pack in self.pack_types:
+                size = struct.calcsize(pack)
+                values.append((offset, size, is_gap(pack)))
+                offset += size
+
+            self.decoder = offset, None, values
         else:
-            n_bytes = 0
+            for pack in self.pack_types:
+                value_struct = struct.Struct(pack)
+                values.append((value_struct, offset))
+                offset += value_struct.size
 
-            for pack_type in self.pack_types:
-                n_bytes += struct.calcsize(pack_type)
-                assert n_bytes % 2 == 0
+            assert offset % 2 == 0
 
-            n_registers = n_bytes // 2
+            if self.byte_order == 'mixed':
+                # reinterpret each big endian register as little endian
+                repack_byte_order = '<'
+            else:
+                # just pack it again to the same stream of bytes we read
+                repack_byte_order = '>'
+
+            self.decoder = offset // 2, struct.Struct('{}{}H'.format(repack_byte_order, offset // 2)), values
+
+        return self.decoder
+
+    def read_registers_send(self, modbus):
+        n_registers, _, _ = self.decoder or self.compile_decoder()
 
         reader = {
                 'c': 'read_coils',
@@ -135,90 +283,120 @@ class Access:
                 'i': 'read_input_registers',
                 }[self.modbus_type]
 
-        self.request = getattr(modbus.protocol, reader)(modbus.slave_id, self.address(), n_registers)
+        request = getattr(modbus.protocol, reader)(modbus.slave_id, self.address(), n_registers)
 
-        logging.debug('→ < %s >', dump(self.request))
+        # the transport might renumber the transaction, keep what it sent
+        self.request = modbus.send(request)
 
-        modbus.send(self.request)
+        logging.debug('→ < %s >', dump(self.request))
 
     def read_registers_receive(self, modbus):
+        self.words = ()
+        self.error = None
+
         try:
             words = modbus.receive(self.request)
         except umodbus.exceptions.IllegalDataAddressError:
-            self.values = ('Invalid address', )
+            gaps = list(self.gaps())
+            if gaps:
+                # maybe it's one of the registers bridging the gaps that
+                # doesn't exist: never bridge these gaps again
+                modbus.illegal_gaps.update((self.modbus_type, address) for address in gaps)
+                self.values = None
+            else:
+                self.values = ('Invalid address', )
             return
         except umodbus.exceptions.IllegalFunctionError:
             self.values = ('Invalid modbus type', )
             return
+        except umodbus.exceptions.ModbusError as e:
+            # e.g. a device failure, the other accesses in flight go on
+            self.values = (error_message(e), )
+            self.error = e
+            return
 
         logging.debug('← %s', words)
 
-        if self.modbus_type in 'cd':
-            self.values = [(w,) for w in words]
-        else:
-            if self.byte_order == 'mixed':
-                # reinterpret each big endian register as little endian
-                repack_byte_order = '<'
-            else:
-                # just pack it again to the same stream of bytes we read
-                repack_byte_order = '>'
+        self.words = words
 
-            packed = struct.pack('{}{}H'.format(repack_byte_order, len(words)), *words)
+        if not getattr(modbus.output, 'needs_values', True):
+            # e.g. ArrayOutput, decoding the words itself
+            self.values = ()
+            return
 
-            self.values = []
+        stats = modbus.stats
+        if stats:
+            start = time.perf_counter()
 
-            for pack in self.pack_types:
-                size = struct.calcsize(pack)
-                self.values.append(struct.unpack(pack, packed[:size]))
-                packed = packed[size:]
+        self.decode()
 
-    def write_registers_send(self, modbus):
-        if self.modbus_type == 'c':
-            if len(self.values_to_write) == 1:
-                # TODO validate value, should be boolean
-                message = modbus.protocol.write_single_coil(
-                        modbus.slave_id, self.address(), int(self.values_to_write[0]))
-            else:
-                message = modbus.protocol.write_multiple_coils(modbus.slave_id, self.address(),
-                                                               [int(v) for v in self.values_to_write])
-        elif self.modbus_type == 'C':
-            message = modbus.protocol.write_multiple_coils(modbus.slave_id, self.address(),
-                                                            [int(v) for v in self.values_to_write])
-        else:
-            words = []
+        if stats:
+            stats.add_time('decode', start)
 
-            if self.byte_order == 'mixed':
-                register_fmt = '<H'
-            else:
-                register_fmt = '>H'
+    def decode(self):
+        """Decode the values from the words read"""
+        _, words_struct, values = self.decoder or self.compile_decoder()
+        words = self.words
 
-            for pack_type, value in zip(self.pack_types, self.values_to_write):
-                n_bytes = struct.calcsize(pack_type)
-                assert n_bytes % 2 == 0
+        if words_struct is None:
+            self.values = [() if gap else tuple(words[offset:offset + size]) for offset, size, gap in values]
+        else:
+            packed = memoryview(words_struct.pack(*words))
+            self.values = [value_struct.unpack_from(packed, offset) for value_struct, offset in values]
+
+    def encode_values(self):
+        """Compute, once, the coils or registers to write"""
+        if self.modbus_type in 'cC':
+            # TODO validate values, should be boolean
+            self.encoded = [int(v) for v in self.values_to_write]
+            return self.encoded
+
+        values = [float(value) if 'f' in pack_type or 'd' in pack_type else int(value, 0)
+                  for pack_type, value in zip(self.pack_types, self.values_to_write)]
+
+        byte_order = self.pack_types[0][0]
+        if byte_order in '=<>!' and all(p[0] == byte_order for p in self.pack_types):
+            # a single struct for all the values
+            packed = struct.pack(byte_order + ''.join(p[1:] for p in self.pack_types), *values)
+        else:
+            # native alignment (or no byte order at all), pack separately
+            packed = b''.join(struct.pack(p, v) for p, v in zip(self.pack_types, values))
 
-                if 'f' in pack_type or 'd' in pack_type:
-                    value = float(value)
-                else:
-                    value = int(value, 0)
+        assert len(packed) % 2 == 0
 
-                words.extend([
-                    struct.unpack(register_fmt, bytes(byte_pair))[0]
-                    for byte_pair in grouper(struct.pack(pack_type, value), 2)
-                ])
+        if self.byte_order == 'mixed':
+            # each register is big endian, i.e. swap the bytes of each one
+            register_byte_order = '<'
+        else:
+            register_byte_order = '>'
 
-            if self.modbus_type == 'h' and len(words) == 1:
-                message = modbus.protocol.write_single_register(modbus.slave_id, self.address(), words[0])
-            else:
-                message = modbus.protocol.write_multiple_registers(modbus.slave_id, self.address(), words)
+        self.encoded = list(struct.unpack('{}{}H'.format(register_byte_order, len(packed) // 2), packed))
+
+        return self.encoded
 
-        logging.debug('→ < %s >', dump(message))
+    def write_registers_send(self, modbus):
+        words = self.encoded or self.encode_values()
+
+        if self.modbus_type == 'c' and len(words) == 1:
+            message = modbus.protocol.write_single_coil(modbus.slave_id, self.address(), words[0])
+        elif self.modbus_type in 'cC':
+            message = modbus.protocol.write_multiple_coils(modbus.slave_id, self.address(), words)
+        elif self.modbus_type == 'h' and len(words) == 1:
+            message = modbus.protocol.write_single_register(modbus.slave_id, self.address(), words[0])
+        else:
+            message = modbus.protocol.write_multiple_registers(modbus.slave_id, self.address(), words)
 
-        self.request = message
+        self.request = modbus.send(message)
 
-        return modbus.send(message)
+        logging.debug('→ < %s >', dump(self.request))
 
     def write_registers_receive(self, modbus):
-        modbus.receive(self.request)
+        try:
+            modbus.receive(self.request)
+            self.error = None
+        except umodbus.exceptions.ModbusError as e:
+            logging.error('Writing %s failed: %s', self, error_message(e))
+            self.error = e
 
     def __str__(self):
         return '{}@{}/{}{}'.format(self.modbus_type,
@@ -239,18 +417,70 @@ def by_address(access):
     return access.address()
 
 
-def group_accesses(accesses):
+def split_access(access):
+    """Split an access too large for a single request into smaller ones
+
+    Only arrays of a single type (e.g. i@0/200H) can be split, each part
+    reading as many whole elements as fit in one request."""
+    max_size = access.max_size()
+    if access.size() <= max_size:
+        return [access]
+
+    match = REPEATED_PACK_TYPE_RE.match(access.pack_type())
+    if access.write or len(access.pack_types) != 1 or not match:
+        raise ValueError('{} exceeds the maximum of {} registers per request'.format(access, max_size))
+
+    byte_order, count, type_ = match.groups()
+    count = int(count)
+    element_size = access.size() // count
+    per_request = max_size // element_size
+
+    parts = []
+    address = access.address()
+    while count:
+        n = min(count, per_request)
+        parts.append(Access(access.modbus_type, [address], ['{}{}{}'.format(byte_order, n, type_)],
+                            names=[access.names[0]], presenters=[access.presenter()],
+                            byte_order=access.byte_order, silent=access.silent))
+        address += n * element_size
+        count -= n
+
+    return parts
+
+
+def group_accesses(accesses, max_gap=0, illegal_gaps=()):
+    """Merge accesses into as few requests as possible
+
+    Reads separated by up to max_gap registers are merged too, reading and
+    discarding the registers in between, unless any of them is in
+    illegal_gaps."""
     grouped = []
 
+    accesses = [part for access in accesses for part in split_access(access)]
+
     for (modbus_type, write, _), xs in groupby(sorted(accesses, key=by_type), key=by_type):
         xs = sorted(xs, key=by_address)
-        while len(xs):
-            first = xs.pop(0)
-            while len(xs):
-                second = xs[0]
-                if first.address() + first.size() == second.address():
+        i = 0
+        while i < len(xs):
+            first = xs[i]
+            i += 1
+            size = first.size()
+            max_size = first.max_size()
+            while i < len(xs):
+                second = xs[i]
+                second_size = second.size()
+                end = first.address() + size
+                gap = second.address() - end
+                if gap == 0 and size + second_size <= max_size:
+                    first.append(second)
+                    size += second_size
+                    i += 1
+                elif (not write and 0 < gap <= max_gap and size + gap + second_size <= max_size
+                        and not any((modbus_type, address) in illegal_gaps for address in range(end, end + gap))):
+                    first.append_gap(gap)
                     first.append(second)
-                    xs.pop(0)
+                    size += gap + second_size
+                    i += 1
                 else:
                     break
             grouped.append(first)
@@ -258,27 +488,38 @@ def group_accesses(accesses):
     return grouped
 
 
-def parse_access(register, name, write, value, byte_order, silent):
-    modbus_type, address, pack_type, presenter = re.match(REGISTER_RE, register).groups()
-
-    if not address:
-        logging.warn('%r is not a known named register nor a valid register definition. Skipping it.', register)
-        return None
+def unbridge_illegal_gaps(accesses):
+    """Split the accesses that failed because of the gaps they bridged
 
-    if not modbus_type:
-        modbus_type = 'h'
-    else:
-        modbus_type = modbus_type[:-1]
+    Returns the new plan and the accesses from it that must be performed
+    again."""
+    plan = []
+    retry = []
 
-    if not pack_type:
-        if modbus_type in 'cCd':
-            pack_type = 'B'
+    for access in accesses:
+        if not access.write and access.values is None:
+            parts = access.split_gaps()
+            plan.extend(parts)
+            retry.extend(parts)
         else:
-            pack_type = 'H'
-    else:
-        pack_type = pack_type[1:]
+            plan.append(access)
+
+    return plan, retry
 
-    address = int(address, 0)
+
+def parse_access(register, name, write, value, byte_order, silent, match=None):
+    """Access a register, either a definition or an already parsed Register
+
+    match is passed on to parse_register."""
+    if isinstance(register, str):
+        definition, register = register, parse_register(register, match)
+        if not register:
+            logging.warning('%r is not a known named register nor a valid register definition. Skipping it.',
+                            definition)
+            return None
+
+    modbus_type = register.modbus_type
+    pack_type = register.pack_type
 
     if pack_type[0] not in '@=<>!':
         if byte_order in ('le', 'mixed'):
@@ -291,11 +532,14 @@ def parse_access(register, name, write, value, byte_order, silent):
     if write and modbus_type not in 'cChH':
         raise ValueError("Invalid Modbus type '{}'. Only coils and holding registers are writable".format(modbus_type))
 
-    return Access(modbus_type, [address], [pack_type], [value],
-                  names=[name], presenters=[presenter], byte_order=byte_order, silent=silent)
+    # there are only a few distinct pack types, share them
+    pack_type = sys.intern(pack_type)
 
+    return Access(modbus_type, [register.address], [pack_type], [value],
+                  names=[name], presenters=[register.presenter], byte_order=byte_order, silent=silent)
 
-def parse_accesses(s, definitions, byte_order='be', silent=False):
+
+def parse_accesses(s, definitions, byte_order='be', silent=False, max_gap=0, group=True):
     accesses = []
 
     for access in s:
@@ -308,16 +552,18 @@ def parse_accesses(s, definitions, byte_order='be', silent=False):
             register, value = parts
             write = True
 
-        if re.fullmatch(REGISTER_RE, register):
-            access = parse_access(register, None, write, value, byte_order, silent)
+        match = REGISTER_RE.fullmatch(register)
+        if match:
+            access = parse_access(register, None, write, value, byte_order, silent, match)
             if access:
                 accesses.append(access)
         else:
-            register_re = re.compile(fnmatch.translate(register))
-            for name, definition in definitions.registers.items():
-                if register_re.match(name):
-                    access = parse_access(definition, name, write, value, byte_order, silent)
-                    if access:
-                        accesses.append(access)
-
-    return group_accesses(accesses)
+            for name, definition in definitions.match(register):
+                access = parse_access(definition, name, write, value, byte_order, silent)
+                if access:
+                    accesses.append(access)
+
+    if not group:
+        return accesses
+
+    return group_accesses(accesses, max_gap)
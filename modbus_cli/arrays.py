@@ -0,0 +1,160 @@
+"""Decoding of uniformly typed values with NumPy, an optional dependency
+
+The registers of an access are viewed as an array of the values' type, in
+a single operation, instead of being unpacked one value at a time."""
+
+import re
+import struct
+import threading
+
+from .access import is_gap
+
+# struct format characters, with standard sizes, and the equivalent dtypes
+NUMPY_TYPES = {
+    '?': 'b1',
+    'b': 'i1',
+    'B': 'u1',
+    'h': 'i2',
+    'H': 'u2',
+    'i': 'i4',
+    'I': 'u4',
+    'l': 'i4',
+    'L': 'u4',
+    'q': 'i8',
+    'Q': 'u8',
+    'e': 'f2',
+    'f': 'f4',
+    'd': 'f8',
+}
+
+NUMPY_BYTE_ORDERS = {'!': '>', '>': '>', '<': '<', '=': '='}
+
+PACK_TYPE_RE = re.compile(r'([=<>!])(\d*)(.)')
+
+FORMATS = ('npy', 'raw')
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('NumPy is required to decode values as arrays, pip install numpy') from None
+    return numpy
+
+
+def array_dtype(access):
+    """The dtype of the values of access, None unless they all have the same type"""
+    types = set()
+
+    for pack_type in access.pack_types:
+        if is_gap(pack_type):
+            continue
+        match = PACK_TYPE_RE.fullmatch(pack_type)
+        if not match or match.group(3) not in NUMPY_TYPES:
+            return None
+        types.add((match.group(1), match.group(3)))
+
+    if len(types) != 1:
+        return None
+
+    byte_order, type_char = types.pop()
+
+    if access.modbus_type in 'cCd':
+        # one coil per element, whatever the pack type
+        return 'u1'
+
+    return NUMPY_BYTE_ORDERS[byte_order] + NUMPY_TYPES[type_char]
+
+
+def plan_dtype(accesses):
+    """The dtype of the values read by accesses, ValueError unless it's the same for all"""
+    dtypes = {}
+
+    for access in accesses:
+        if access.write:
+            continue
+        dtype = array_dtype(access)
+        if dtype is None:
+            raise ValueError('The values at {} cannot be decoded as an array'.format(
+                ', '.join(map(str, access.labels()))))
+        dtypes.setdefault(dtype, access)
+
+    if len(dtypes) > 1:
+        raise ValueError('Values of different types ({}), they cannot be output as a single array'.format(
+            ', '.join('{} at {}'.format(dtype, next(access.labels())) for dtype, access in dtypes.items())))
+
+    return next(iter(dtypes), None)
+
+
+def decode_array(access):
+    """The values read by access, as a single NumPy array"""
+    numpy = import_numpy()
+
+    dtype = array_dtype(access)
+    if dtype is None:
+        raise ValueError('Values of different types at {}, they cannot be decoded as an array'.format(
+            ', '.join(map(str, access.labels()))))
+
+    if access.modbus_type in 'cCd':
+        data = numpy.array(access.words, dtype='u1')
+    else:
+        # the bytes as they were received, except that with the mixed byte
+        # order the bytes of each register are swapped
+        data = numpy.array(access.words, dtype='<u2' if access.byte_order == 'mixed' else '>u2').view('u1')
+
+    if any(is_gap(pack_type) for pack_type in access.pack_types):
+        parts = []
+        offset = 0
+        for pack_type in access.pack_types:
+            size = struct.calcsize(pack_type)
+            if not is_gap(pack_type):
+                parts.append(data[offset:offset + size])
+            offset += size
+        data = numpy.concatenate(parts)
+
+    return data.view(dtype)
+
+
+class ArrayOutput:
+    """Binary output of the values read during a cycle, as a single array
+
+    Either in NumPy's .npy format, one array after the other, or as raw
+    bytes. The values of all the accesses of a cycle, that must be of the
+    same type, are concatenated in order."""
+
+    # see Access.read_registers_receive, arrays are decoded from the words
+    needs_values = False
+
+    def __init__(self, stream, format):
+        self.numpy = import_numpy()
+        self.stream = stream
+        self.format = format
+        self.arrays = []
+        # devices can be accessed concurrently
+        self.lock = threading.Lock()
+
+    def write(self, access, definitions, tag=None, timestamp=None):
+        if not access.words:
+            # nothing was read, e.g. an invalid address
+            return
+
+        array = decode_array(access)
+        with self.lock:
+            if self.arrays and self.arrays[0].dtype != array.dtype:
+                raise ValueError('Values of different types ({} and {}), they cannot be output as a single '
+                                 'array'.format(self.arrays[0].dtype, array.dtype))
+            self.arrays.append(array)
+
+    def flush(self):
+        with self.lock:
+            arrays, self.arrays = self.arrays, []
+
+        if not arrays:
+            return
+
+        array = arrays[0] if len(arrays) == 1 else self.numpy.concatenate(arrays)
+        if self.format == 'npy':
+            self.numpy.save(self.stream, array, allow_pickle=False)
+        else:
+            self.stream.write(array.tobytes())
+        self.stream.flush()
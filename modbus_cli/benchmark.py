@@ -0,0 +1,136 @@
+"""Measure the throughput and latency of the transports against the simulator
+
+  python -m modbus_cli.benchmark [--cycles N] [--sizes N,N,...] [--windows N,N,...]
+
+For each transport, plan size (number of read operations) and window (TCP
+operations in flight) the plan is performed cycles times, reporting the
+requests and the registers per second and the median and 99th percentile
+latency of single requests."""
+
+import argparse
+import logging
+import time
+
+from .access import Access
+from .simulator import Simulator, TcpSimulator, RtuSimulator
+
+
+class Discard:
+    """Output dropping the values, only their decoding is measured"""
+
+    def write(self, access, definitions, tag=None, timestamp=None):
+        pass
+
+    def flush(self):
+        pass
+
+
+def make_plan(n_accesses, n_registers):
+    """n_accesses reads of n_registers holding registers each"""
+    return [Access('h', [n * n_registers], ['>{}H'.format(n_registers)]) for n in range(n_accesses)]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def run(modbus, plan, cycles):
+    """Perform plan cycles times, returning the statistics"""
+    latencies = []
+    sent = {}
+    send = modbus.send
+    receive = modbus.receive
+
+    def timed_send(request):
+        request = send(request)
+        sent[request] = time.perf_counter()
+        return request
+
+    def timed_receive(request):
+        try:
+            return receive(request)
+        finally:
+            latencies.append(time.perf_counter() - sent.pop(request))
+
+    modbus.send = timed_send
+    modbus.receive = timed_receive
+    modbus.output = Discard()
+    try:
+        start = time.perf_counter()
+        for _ in range(cycles):
+            modbus.perform_accesses(plan, None)
+        elapsed = time.perf_counter() - start
+    finally:
+        del modbus.send, modbus.receive
+
+    requests = len(plan) * cycles
+    return {
+        'requests/s': requests / elapsed,
+        'registers/s': sum(access.size() for access in plan) * cycles / elapsed,
+        'p50 ms': percentile(latencies, 50) * 1000,
+        'p99 ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def benchmark(transports=('tcp', 'rtu'), sizes=(1, 10, 100), windows=(1, 4, 16), registers=10, cycles=20,
+              latency=0, jitter=0, baud=115200):
+    """Yield a row of statistics for each combination of the parameters"""
+    simulator = Simulator(latency=latency, jitter=jitter)
+
+    if 'tcp' in transports:
+        server = TcpSimulator(simulator)
+        try:
+            for window in windows:
+                modbus = server.connect(window=window)
+                try:
+                    for size in sizes:
+                        yield dict(transport='tcp', accesses=size, window=window,
+                                   **run(modbus, make_plan(size, registers), cycles))
+                finally:
+                    modbus.close()
+        finally:
+            server.close()
+
+    if 'rtu' in transports:
+        server = RtuSimulator(simulator)
+        try:
+            modbus = server.connect(baud=baud)
+            try:
+                for size in sizes:
+                    yield dict(transport='rtu', accesses=size, window=1,
+                               **run(modbus, make_plan(size, registers), cycles))
+            finally:
+                modbus.close()
+        finally:
+            server.close()
+
+
+def numbers(s):
+    return [int(n) for n in s.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m modbus_cli.benchmark')
+    parser.add_argument('--transports', default='tcp,rtu')
+    parser.add_argument('--sizes', type=numbers, default=[1, 10, 100], metavar='N,N,...')
+    parser.add_argument('--windows', type=numbers, default=[1, 4, 16], metavar='N,N,...')
+    parser.add_argument('--registers', type=int, default=10, metavar='N')
+    parser.add_argument('--cycles', type=int, default=20, metavar='N')
+    parser.add_argument('--latency', type=float, default=0, metavar='SECONDS')
+    parser.add_argument('--jitter', type=float, default=0, metavar='SECONDS')
+    parser.add_argument('-b', '--baud', type=int, default=115200)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    columns = ['transport', 'accesses', 'window', 'requests/s', 'registers/s', 'p50 ms', 'p99 ms']
+    print(''.join('{:>12}'.format(column) for column in columns))
+    for row in benchmark(args.transports.split(','), args.sizes, args.windows, args.registers, args.cycles,
+                         args.latency, args.jitter, args.baud):
+        print(''.join('{:>12}'.format(row[column]) if isinstance(row[column], (str, int))
+                      else '{:>12.1f}'.format(row[column]) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
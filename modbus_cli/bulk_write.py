@@ -0,0 +1,59 @@
+import logging
+import time
+from itertools import islice
+
+from .access import group_accesses, parse_accesses
+
+
+def parse_writes(lines):
+    """Turn 'name value' or 'name,value' lines into NAME=VALUE accesses"""
+    for line in lines:
+        parts = line.split('#')[0].replace(',', ' ').split()
+        if len(parts) == 2:
+            yield '{}={}'.format(*parts)
+        elif parts:
+            logging.warning('Invalid write %r. Skipping it.', line.strip())
+
+
+def write_from(modbus, lines, definitions, byte_order='be', silent=False, batch_size=1000):
+    """Write the values read from lines, batch_size lines at a time
+
+    Each batch is grouped into as few write requests as possible, which are
+    then pipelined over the connection. The last request of a batch, unless
+    full, is held back to be continued by the next batch."""
+    writes = parse_writes(lines)
+
+    n_values = 0
+    n_frames = 0
+    n_rejected = 0
+    start = time.monotonic()
+    pending = []
+
+    while True:
+        batch = list(islice(writes, batch_size))
+
+        accesses = group_accesses(pending + parse_accesses(batch, definitions, byte_order, silent, group=False))
+        pending = []
+        if batch and accesses and accesses[-1].size() < accesses[-1].max_size():
+            pending.append(accesses.pop())
+
+        if accesses:
+            modbus.perform_accesses(accesses, definitions)
+
+        for access in accesses:
+            n_frames += 1
+            if access.error:
+                n_rejected += 1
+            else:
+                n_values += len(access.values_to_write)
+
+        if not batch:
+            break
+
+    elapsed = time.monotonic() - start
+
+    if not silent:
+        logging.info('Wrote %d values in %d requests in %.3fs (%.0f values/s), %d requests rejected',
+                     n_values, n_frames, elapsed, n_values / elapsed if elapsed else 0, n_rejected)
+
+    return n_values, n_frames, n_rejected
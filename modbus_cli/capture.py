@@ -0,0 +1,235 @@
+"""Capture of the raw responses to a ring file, to be decoded later
+
+The file starts with a fixed prelude (magic, length of the header, size and
+number of records, number of records written so far) followed by a JSON
+header describing the registers read from each target, and then by the
+records. Each record holds the time a response was received, which target,
+modbus type and addresses it's for, and the registers (big endian, as
+received) or coils (one byte each) it contained. Once the file is full the
+oldest records are overwritten.
+
+Capturing does nothing but copy the words of each response into the memory
+mapped file, the values are decoded by replay, through the same pack types
+and presenters as when they are printed right away."""
+
+import json
+import logging
+import mmap
+import struct
+import threading
+import time
+
+from .access import Access, MAX_QUANTITY, is_gap, register_count, split_access
+
+MAGIC = b'MBCAPT\x00\x01'
+
+# magic, header length, record size, number of records, records written
+PRELUDE = struct.Struct('<8sIIQQ')
+WRITTEN_OFFSET = 24
+
+# time, target, modbus type, address, count
+RECORD = struct.Struct('<dHcxHH')
+
+# records are aligned for the time to be
+ALIGNMENT = 8
+
+# records decoded before flushing the output
+REPLAY_FLUSH = 1000
+
+
+def align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def describe(accesses):
+    """The registers read by the (ungrouped) accesses, as stored in the header
+
+    Arrays too large for a single request are described as the parts they
+    are read in, each of which is in a record of its own."""
+    return [[part.modbus_type, address, pack_type, name, presenter]
+            for access in accesses
+            for part in split_access(access)
+            for address, pack_type, name, presenter in zip(part.addresses, part.pack_types, part.names,
+                                                           part.presenters)
+            if not is_gap(pack_type)]
+
+
+def payload_size(registers):
+    """Size of the largest response for the registers
+
+    Any access starts at a register and ends at another one (it may bridge
+    gaps in between), so it's no larger than the span of the registers of
+    its modbus type."""
+    spans = {}
+    for modbus_type, address, pack_type, _, _ in registers:
+        end = address + register_count(modbus_type, pack_type)
+        first, last = spans.get(modbus_type, (address, end))
+        spans[modbus_type] = min(first, address), max(last, end)
+
+    size = 0
+    for modbus_type, (first, last) in spans.items():
+        count = min(last - first, MAX_QUANTITY[(modbus_type, False)])
+        size = max(size, count if modbus_type in 'cCd' else 2 * count)
+
+    return size
+
+
+class Capture:
+    """Output copying the words read to a capture file, without decoding them
+
+    targets is a list of (tag, registers) with the registers as returned by
+    describe()."""
+
+    # see Access.read_registers_receive, values are decoded by replay
+    needs_values = False
+
+    def __init__(self, filename, records, targets, byte_order='be', silent=False):
+        header = json.dumps({
+            'byte_order': byte_order,
+            'silent': silent,
+            'targets': [{'tag': tag, 'registers': registers} for tag, registers in targets],
+        }).encode()
+
+        self.record_size = align(RECORD.size + max((payload_size(registers) for _, registers in targets), default=0))
+        self.records = records
+        self.start = align(PRELUDE.size + len(header))
+        self.targets = {tag: n for n, (tag, _) in enumerate(targets)}
+        self.written = 0
+        # registers, by count
+        self.structs = {}
+        # devices can be accessed concurrently
+        self.lock = threading.Lock()
+
+        size = self.start + records * self.record_size
+        with open(filename, 'w+b') as f:
+            f.truncate(size)
+            self.mm = mmap.mmap(f.fileno(), size)
+
+        PRELUDE.pack_into(self.mm, 0, MAGIC, len(header), self.record_size, records, 0)
+        self.mm[PRELUDE.size:PRELUDE.size + len(header)] = header
+
+    def write(self, access, definitions, tag=None, timestamp=None):
+        words = access.words
+        if access.write or not words:
+            return
+
+        timestamp = time.time() if timestamp is None else timestamp
+        count = len(words)
+
+        with self.lock:
+            offset = self.start + self.written % self.records * self.record_size
+            # the record isn't valid until it's complete
+            self.mm[offset:offset + ALIGNMENT] = bytes(ALIGNMENT)
+
+            if access.modbus_type in 'cCd':
+                self.mm[offset + RECORD.size:offset + RECORD.size + count] = bytes(words)
+            else:
+                words_struct = self.structs.get(count)
+                if words_struct is None:
+                    words_struct = self.structs[count] = struct.Struct('>{}H'.format(count))
+                words_struct.pack_into(self.mm, offset + RECORD.size, *words)
+
+            RECORD.pack_into(self.mm, offset, timestamp, self.targets[tag], access.modbus_type.encode(),
+                             access.address(), count)
+
+            self.written += 1
+            struct.pack_into('<Q', self.mm, WRITTEN_OFFSET, self.written)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.written > self.records:
+            logging.info('Captured %d responses, the last %d of which were kept', self.written, self.records)
+        else:
+            logging.info('Captured %d responses', self.written)
+        self.mm.flush()
+        self.mm.close()
+
+
+def read_header(mm, filename):
+    if len(mm) < PRELUDE.size:
+        raise ValueError('{} is not a capture file'.format(filename))
+
+    magic, header_size, record_size, records, written = PRELUDE.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise ValueError('{} is not a capture file'.format(filename))
+
+    header = json.loads(mm[PRELUDE.size:PRELUDE.size + header_size].decode())
+    start = align(PRELUDE.size + header_size)
+    if len(mm) < start + records * record_size:
+        raise ValueError('{} is truncated'.format(filename))
+
+    return header, start, record_size, records, written
+
+
+class Decoder:
+    """The accesses to decode a record with, one per register in it"""
+
+    def __init__(self, header):
+        self.byte_order = header['byte_order']
+        self.silent = header['silent']
+        self.registers = [target['registers'] for target in header['targets']]
+        # (target, modbus type, address, count) -> [(access, start, end)]
+        self.cache = {}
+
+    def accesses(self, target, modbus_type, address, count):
+        key = target, modbus_type, address, count
+        accesses = self.cache.get(key)
+        if accesses is None:
+            accesses = self.cache[key] = []
+            for type_, first, pack_type, name, presenter in self.registers[target]:
+                if type_ != modbus_type:
+                    continue
+                start = first - address
+                end = start + register_count(modbus_type, pack_type)
+                if start >= 0 and end <= count:
+                    access = Access(modbus_type, [first], [pack_type], names=[name], presenters=[presenter],
+                                    byte_order=self.byte_order, silent=self.silent)
+                    accesses.append((access, start, end))
+            accesses.sort(key=lambda x: x[1])
+            if not accesses:
+                logging.warning('No registers described for the records of %d %s@%d, skipping them', count,
+                                modbus_type, address)
+
+        return accesses
+
+
+def replay(filename, definitions, make_output):
+    """Decode the records of a capture file, oldest first
+
+    make_output(tagged) returns the output to write the values to. Returns
+    the number of records decoded."""
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header, start, record_size, records, written = read_header(mm, filename)
+        tags = [target['tag'] for target in header['targets']]
+        output = make_output(len(tags) > 1)
+        decoder = Decoder(header)
+
+        n = 0
+        for i in range(max(0, written - records), written):
+            offset = start + i % records * record_size
+            timestamp, target, modbus_type, address, count = RECORD.unpack_from(mm, offset)
+            if not timestamp:
+                # interrupted while being written
+                continue
+
+            modbus_type = modbus_type.decode()
+            offset += RECORD.size
+            if modbus_type in 'cCd':
+                words = list(mm[offset:offset + count])
+            else:
+                words = struct.unpack_from('>{}H'.format(count), mm, offset)
+
+            for access, first, last in decoder.accesses(target, modbus_type, address, count):
+                access.words = words[first:last]
+                access.decode()
+                output.write(access, definitions, tags[target], timestamp)
+
+            n += 1
+            if n % REPLAY_FLUSH == 0:
+                output.flush()
+
+        output.flush()
+
+    return n
@@ -1,33 +1,207 @@
 import re
+import os
+import math
+import struct
+import fnmatch
+from bisect import bisect_left
+import pickle
+import hashlib
 import logging
+from collections import namedtuple
 
 REGISTER_RE = re.compile(r'^([cCdhHi]@)?(\d+|0x[0-9a-fA-F]+)(/[^:|]*)?([:|].*)?$')
 
+# A parsed register definition, with the defaults applied. The byte order is
+# applied later, see parse_access, unless the pack type specifies one.
+# deadband is the change needed for a new value to be reported, see Changes,
+# and scan the period at which to read the register when polling, see
+# Scheduler.
+Register = namedtuple('Register', 'modbus_type address pack_type presenter deadband scan',
+                      defaults=(None, None))
+
+# amount is either absolute or, when relative is true, a percentage of the
+# last value reported
+Deadband = namedtuple('Deadband', 'amount relative')
+
+
+def parse_period(s):
+    """Parse a scan period, in seconds or 'once'"""
+    if s == 'once':
+        return math.inf
+    period = float(s)
+    if not period > 0:
+        raise ValueError('The period must be positive')
+    return period
+
+
+def parse_deadband(s):
+    """Parse a deadband, e.g. 0.5 or 2%"""
+    if s.endswith('%'):
+        return Deadband(float(s[:-1]), True)
+    return Deadband(float(s), False)
+
+
+def parse_register(definition, match=None):
+    """Parse a register definition, None if it's not a valid one
+
+    match is the result of matching REGISTER_RE against definition, if
+    already known."""
+    if match is None:
+        match = REGISTER_RE.match(definition)
+        if not match:
+            return None
+
+    modbus_type, address, pack_type, presenter = match.groups()
+
+    if not modbus_type:
+        modbus_type = 'h'
+    else:
+        modbus_type = modbus_type[:-1]
+
+    if not pack_type:
+        if modbus_type in 'cCd':
+            pack_type = 'B'
+        else:
+            pack_type = 'H'
+    else:
+        pack_type = pack_type[1:]
+
+    try:
+        # standard sizes, unless native ones are asked for explicitly
+        size = struct.calcsize(pack_type if pack_type[:1] in ('@', '=', '<', '>', '!') else '=' + pack_type)
+    except struct.error:
+        return None
+
+    if modbus_type in 'hHi' and size % 2:
+        # not a whole number of registers
+        return None
+
+    return Register(modbus_type, int(address, 0), pack_type, presenter)
+
+
+# bump when the parsed representation changes, to invalidate the caches
+CACHE_VERSION = 5
+
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'modbus_cli')
+
 
 class Definitions:
-    def __init__(self, silent):
+    def __init__(self, silent, cache_dir=None):
         self.registers = {}
         self.presenters = {}
         self.silent = silent
+        # where to cache the parsed files, None not to cache them
+        self.cache_dir = cache_dir
+        # sorted names of the registers, see match
+        self.names = None
 
     def parse(self, filenames):
         for filename in filenames:
             if filename:
-                with open(filename) as f:
-                    self.filename = filename
-                    self.line = 0
-                    accumulated_line = ''
-                    for line in f:
-                        self.line += 1
-                        if line[0].isspace():
-                            accumulated_line += line
-                        else:
-                            self.parse_line(accumulated_line)
-                            accumulated_line = line
-                    self.parse_line(accumulated_line)
+                registers, presenters = self.load_cache(filename) or self.parse_file(filename)
+                self.registers.update(registers)
+                self.presenters.update(presenters)
+                self.names = None
         if not self.silent:
             logging.info('Parsed %d registers definitions from %d files', len(self.registers), len(filenames))
 
+    def match(self, pattern):
+        """The names and definitions of the registers matching a glob pattern"""
+        wildcards = [i for i in (pattern.find(c) for c in '*?[') if i >= 0]
+
+        if not wildcards:
+            if pattern in self.registers:
+                return [(pattern, self.registers[pattern])]
+            return []
+
+        pattern_re = re.compile(fnmatch.translate(pattern))
+        prefix = pattern[:min(wildcards)]
+
+        if not prefix:
+            return [(name, definition) for name, definition in self.registers.items() if pattern_re.match(name)]
+
+        # only the names starting with the literal prefix can match
+        if self.names is None:
+            self.names = sorted(self.registers)
+
+        matches = []
+        for i in range(bisect_left(self.names, prefix), len(self.names)):
+            name = self.names[i]
+            if not name.startswith(prefix):
+                break
+            if pattern_re.match(name):
+                matches.append((name, self.registers[name]))
+
+        return matches
+
+    def parse_file(self, filename):
+        """Parse a single file, returning its registers and presenters"""
+        # before reading, not to cache a file modified while parsing it
+        signature = self.file_signature(filename) if self.cache_dir else None
+
+        registers, presenters = self.registers, self.presenters
+        self.registers, self.presenters = {}, {}
+
+        try:
+            with open(filename) as f:
+                self.filename = filename
+                self.line = 0
+                accumulated_line = ''
+                for line in f:
+                    self.line += 1
+                    if line[0].isspace():
+                        accumulated_line += line
+                    else:
+                        self.parse_line(accumulated_line)
+                        accumulated_line = line
+                self.parse_line(accumulated_line)
+
+            parsed = self.registers, self.presenters
+        finally:
+            self.registers, self.presenters = registers, presenters
+
+        if self.cache_dir:
+            self.save_cache(filename, signature, parsed)
+
+        return parsed
+
+    def cache_path(self, filename):
+        key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def file_signature(self, filename):
+        stat = os.stat(filename)
+        return CACHE_VERSION, os.path.abspath(filename), stat.st_mtime_ns, stat.st_size
+
+    def load_cache(self, filename):
+        """The cached registers and presenters of filename, if still valid"""
+        if not self.cache_dir:
+            return None
+
+        try:
+            with open(self.cache_path(filename), 'rb') as f:
+                signature, parsed = pickle.load(f)
+        except Exception:
+            return None
+
+        if signature != self.file_signature(filename):
+            return None
+
+        return parsed
+
+    def save_cache(self, filename, signature, parsed):
+        path = self.cache_path(filename)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump((signature, parsed), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logging.debug('Could not cache %s: %s', filename, e)
+
     def parse_line(self, line):
         if not line:
             return
@@ -42,11 +216,12 @@ class Definitions:
             self.presenters[name] = values
         else:
             parts = line.split()
-            if len(parts) == 2:
-                name, definition = parts
+            if len(parts) >= 2:
+                name, definition, *options = parts
 
-                if REGISTER_RE.match(definition):
-                    self.registers[name] = definition
+                register = parse_register(definition)
+                if register:
+                    self.registers[name] = self.parse_options(register, options)
                 else:
                     logging.warning('%s:%d:Invalid definition %r for register %r. Skipping it.',
                                     self.filename, self.line, definition, name)
@@ -54,6 +229,22 @@ class Definitions:
                 logging.warning('%s:%d:Invalid definition %r. Skipping it.',
                                 self.filename, self.line, line)
 
+    def parse_options(self, register, options):
+        """Apply the key=value options following a register definition"""
+        for option in options:
+            key, _, value = option.partition('=')
+            try:
+                if key == 'deadband':
+                    register = register._replace(deadband=parse_deadband(value))
+                elif key == 'scan':
+                    register = register._replace(scan=parse_period(value))
+                else:
+                    raise ValueError('unknown option')
+            except ValueError:
+                logging.warning('%s:%d:Invalid option %r. Ignoring it.', self.filename, self.line, option)
+
+        return register
+
     def parse_presenter(self, line):
         parts = line.split()
 
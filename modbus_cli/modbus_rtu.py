@@ -1,6 +1,42 @@
 import logging
+import time
+
+from umodbus.client.serial.redundancy_check import get_crc
+from umodbus.exceptions import ModbusError
 
 from .access import dump
+from .output import LogOutput
+from .retry import wait_before_retry
+
+
+# Time it can take for received bytes to reach us, e.g. USB adapters deliver
+# them in bursts every few milliseconds
+RECEIVE_LATENCY = 0.02
+
+
+def expected_length(frame):
+    """The length of the response frame starting at frame[0], None if not known yet"""
+    if len(frame) < 2:
+        return None
+    function = frame[1]
+    if function & 0x80:
+        return 5
+    if function in (1, 2, 3, 4):
+        return 5 + frame[2] if len(frame) >= 3 else None
+    return 8
+
+
+def resync(frame, slave_id, function):
+    """Drop the bytes before the first one that could start the response"""
+    for start in range(len(frame)):
+        if frame[start] == slave_id and (start + 1 == len(frame) or frame[start + 1] & 0x7f == function):
+            break
+    else:
+        start = len(frame)
+
+    if start:
+        logging.debug('← < %s > discarded', dump(frame[:start]))
+        del frame[:start]
 
 
 class ModbusRtu:
@@ -12,9 +48,34 @@ class ModbusRtu:
         self.baud = baud
         self.parity = parity_opts[parity]
         self.stop_bits = stop_bits
+        # Frames must be separated by at least 3.5 characters of silence, a
+        # fixed 1.75ms above 19200 baud (Modbus over serial line, 2.5.1.1)
+        if baud > 19200:
+            self.frame_silence = 0.00175
+        else:
+            self.frame_silence = 3.5 * (1 + 8 + (parity != 'n') + stop_bits) / baud
+        # a response ends after its expected length, or when the line stays
+        # silent for longer than between two frames
+        self.read_timeout = self.frame_silence + RECEIVE_LATENCY
+        self.last_activity = 0
+        self.connection = None
         if slave_id is None:
             slave_id = 1
         self.slave_id = slave_id
+        # (modbus type, address) of registers that must not be read to bridge gaps
+        self.illegal_gaps = set()
+        # device (and slave id) the values come from, see Target
+        self.tag = None
+        self.output = LogOutput()
+        # see Stats
+        self.stats = None
+        # how many times to retry a request, and the wait before the first retry
+        self.retries = 0
+        self.backoff = 0.1
+        # whether the port must be reopened before it's used again
+        self.broken = False
+        # see Rtt, None to always wait for timeout
+        self.rtt = None
 
         import umodbus.client.serial.rtu as modbus
         self.protocol = modbus
@@ -30,44 +91,166 @@ class ModbusRtu:
                       self.timeout,
                       )
 
+        if self.stats:
+            start = time.perf_counter()
+
         self.connection = Serial(port=self.device, baudrate=self.baud, parity=self.parity,
-                                 stopbits=self.stop_bits, bytesize=8, timeout=self.timeout)
+                                 stopbits=self.stop_bits, bytesize=8, timeout=self.read_timeout)
+
+        if self.stats:
+            self.stats.add_time('connect', start)
 
     def send(self, request):
-        self.connection.write(request)
+        silence = self.last_activity + self.frame_silence - time.monotonic()
+        if silence > 0:
+            time.sleep(silence)
 
-    def receive(self, request):
-        response = self.connection.read(2)
-        if len(response) != 2:
-            raise RuntimeError('timeout')
-        slave_id, function = response
+        stats = self.stats
+        if stats:
+            start = time.perf_counter()
+            self.connection.write(request)
+            self.connection.flush()
+            stats.add_time('send', start)
+            stats.count(request[1], 'requests')
+            stats.count(request[1], 'bytes sent', len(request))
+        else:
+            self.connection.write(request)
+            self.connection.flush()
+        self.last_activity = time.monotonic()
+
+        return request
 
+    def receive(self, request):
         try:
-            if function in (1, 2, 3, 4):
-                # Functions with variable size
-                response += self.connection.read(1)
-                count = 2 + response[-1]
-                response += self.connection.read(count)
-            elif function in (5, 6, 15, 16):
-                # Function with fixed size
-                response += self.connection.read(6)
-            elif function & 0x80:
-                response += self.connection.read(3)
-            else:
-                response += self.connection.read(1024)
-                raise NotImplementedError('RTU function {}'.format(function))
+            return self.receive_response(request)
+        except TimeoutError:
+            if self.stats:
+                self.stats.count(request[1], 'timeouts')
+            raise
         finally:
-            logging.debug('← < %s > %s bytes', dump(response), len(response))
+            self.last_activity = time.monotonic()
+
+    def discard_input(self):
+        """Drop what's left of a frame, e.g. the late answer to a timed out request"""
+        self.connection.reset_input_buffer()
 
-        return self.protocol.parse_response_adu(response, request)
+    def receive_response(self, request):
+        stats = self.stats
+        if stats:
+            start = time.perf_counter()
+
+        slave_id, function = request[0], request[1]
+        sent = time.monotonic()
+        if self.rtt:
+            # the time to the first byte, i.e. the device turnaround: the
+            # time to receive the rest depends on the baud rate and the size
+            key = '{}/{}/{}'.format(self.device, slave_id, function)
+            deadline = sent + self.rtt.timeout(key)
+        else:
+            deadline = sent + self.timeout
+        frame = bytearray()
+        received = False
+        # whether what looked like the response had an invalid CRC
+        corrupted = False
+
+        while True:
+            length = expected_length(frame)
+            if length is not None and len(frame) >= length:
+                if frame[length - 2:length] == get_crc(frame[:length - 2]):
+                    break
+                # not a frame after all, look for one starting later
+                logging.debug('← < %s > invalid CRC', dump(frame[:length]))
+                corrupted = True
+                del frame[0]
+                resync(frame, slave_id, function)
+                continue
+
+            if not frame and time.monotonic() > deadline:
+                if self.rtt:
+                    self.rtt.timed_out(key)
+                raise TimeoutError('timeout')
+
+            data = self.connection.read((length or 5) - len(frame))
+
+            if not data:
+                # nothing received for more than a frame silence
+                if frame:
+                    logging.debug('← < %s > incomplete', dump(frame))
+                    raise TimeoutError('incomplete response')
+                if corrupted:
+                    raise TimeoutError('invalid CRC')
+                continue
+
+            if not received:
+                if stats:
+                    start = stats.add_time('wait', start)
+                if self.rtt:
+                    self.rtt.sample(key, time.monotonic() - sent)
+            received = True
+
+            frame += data
+            resync(frame, slave_id, function)
+
+        response = bytes(frame[:length])
+        logging.debug('← < %s > %s bytes', dump(response), len(response))
+
+        if not stats:
+            return self.protocol.parse_response_adu(response, request)
+
+        start = stats.add_time('receive', start)
+        stats.count(request[1], 'bytes received', len(response))
+        try:
+            return self.protocol.parse_response_adu(response, request)
+        except ModbusError:
+            stats.count(request[1], 'exceptions')
+            raise
+        finally:
+            stats.add_time('decode', start)
 
     def close(self):
-        self.connection.close()
+        if self.connection:
+            self.connection.close()
+
+    def reconnect(self):
+        if self.connection:
+            try:
+                self.connection.close()
+            except OSError:
+                pass
+        self.connect()
+        self.broken = False
 
     def perform_accesses(self, accesses, definitions):
         for access in accesses:
-            access.perform(self)
-            if not access.write:
-                access.print_values(definitions)
+            attempt = 0
+            while True:
+                try:
+                    if self.broken:
+                        self.reconnect()
+                    access.perform(self)
+                    break
+                except OSError as e:
+                    if isinstance(e, TimeoutError) and not self.broken:
+                        # drop what's left of a late or garbled response
+                        try:
+                            self.discard_input()
+                        except OSError:
+                            self.broken = True
+                    else:
+                        # e.g. a USB adapter unplugged and plugged back
+                        self.broken = True
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    wait_before_retry(self, access.request[1] if access.request else None, attempt, e)
+
+            if access.write:
+                continue
+            if self.stats:
+                start = time.perf_counter()
+                self.output.write(access, definitions, self.tag)
+                self.stats.add_time('output', start)
+            else:
+                self.output.write(access, definitions, self.tag)
 
         return self
@@ -1,18 +1,61 @@
+import select
 import struct
 import logging
 import time
 
+from umodbus.exceptions import ModbusError
+
 from .access import dump
+from .output import LogOutput
+from .retry import wait_before_retry
+
+
+# an MBAP header and the largest PDU
+MAX_ADU_SIZE = 260
+
+# room for many pipelined responses, received with a single call
+BUFFER_SIZE = 64 * 1024
 
 
 class ModbusTcp:
-    def __init__(self, host, port, slave_id, timeout):
+    def __init__(self, host, port, slave_id, timeout, window=None):
         self.host = host
         self.port = port
         if slave_id is None:
             slave_id = 255
         self.slave_id = slave_id
+        # (modbus type, address) of registers that must not be read to bridge gaps
+        self.illegal_gaps = set()
+        # device (and slave id) the values come from, see Target
+        self.tag = None
+        self.output = LogOutput()
+        # see Stats
+        self.stats = None
+        # how many times to retry a request, and the wait before the first retry
+        self.retries = 0
+        self.backoff = 0.1
+        # whether the connection must be reopened before it's used again
+        self.broken = False
+        # see Rtt, None to always wait for timeout
+        self.rtt = None
         self.timeout = timeout
+        self.connection = None
+        # maximum number of transactions in flight, None for no limit
+        self.window = window
+        self.transaction_id = 0
+        # send time of the transactions in flight, by transaction id
+        self.sent = {}
+        # the transaction sent while no other one was in flight, if still in
+        # flight: its response time doesn't include waiting behind others
+        self.alone = None
+        # when the last data and the last response were received
+        self.arrival = self.last_arrival = 0
+        # responses received before their turn, by transaction id
+        self.responses = {}
+        # received data, frames not parsed yet are in buffer[start:end]
+        self.buffer = bytearray(BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = self.end = 0
 
         import umodbus.client.tcp as modbus
 
@@ -21,14 +64,29 @@ class ModbusTcp:
     def connect(self):
         import socket
 
+        self.start = self.end = 0
+        stats = self.stats
+        if stats:
+            start = time.perf_counter()
+
         addr_info = socket.getaddrinfo(
             self.host, self.port, socket.AF_UNSPEC, socket.SOCK_STREAM
         )
 
+        if stats:
+            stats.add_time('dns', start)
+
         for af, socktype, proto, _, sa in addr_info:
             try:
+                if stats:
+                    start = time.perf_counter()
                 self.connection = socket.socket(af, socktype, proto)
                 self.connection.connect(sa)
+                if stats:
+                    stats.add_time('connect', start)
+                # requests are small and pipelined, don't hold them back
+                # waiting for the acknowledgement of the previous ones
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.connection.settimeout(self.timeout)
                 return
             except OSError:
@@ -37,44 +95,206 @@ class ModbusTcp:
         raise OSError(f"Could not connect to {self.host}")
 
     def send(self, request):
-        self.connection.send(request)
+        # Number the transactions sequentially (umodbus picks them at random)
+        # so that responses can be matched to the requests in flight
+        self.transaction_id = (self.transaction_id + 1) % 0x10000
+        request = struct.pack(">H", self.transaction_id) + request[2:]
+
+        if not self.sent:
+            self.alone = self.transaction_id
+        self.sent[self.transaction_id] = time.monotonic()
+        stats = self.stats
+        if stats:
+            start = time.perf_counter()
+            self.connection.sendall(request)
+            stats.add_time('send', start)
+            stats.count(request[7], 'requests')
+            stats.count(request[7], 'bytes sent', len(request))
+        else:
+            self.connection.sendall(request)
+
+        return request
 
     def receive(self, request):
-        header = self.receive_n(6)
-        seq, _, count = struct.unpack(">3H", header)
-        sent_seq = struct.unpack(">H", request[:2])[0]
-        if seq != sent_seq:
-            logging.warn("Sequence mismatch: sent %s, received %s", sent_seq, seq)
-        response = header + self.receive_n(count)
+        transaction_id = struct.unpack(">H", request[:2])[0]
+        sent = self.sent[transaction_id]
+        if self.rtt:
+            # by device, unit id and function code, see parse_frames
+            key = '{}:{}/{}/{}'.format(self.host, self.port, request[6], request[7])
+            timeout = self.rtt.timeout(key)
+        else:
+            timeout = self.timeout
+
+        try:
+            self.parse_frames()
+
+            while transaction_id not in self.responses:
+                # with pipelining the device might start on the request
+                # only after it answers the previous one
+                deadline = max(sent, self.last_arrival) + timeout
+                self.fill(request[7], deadline - time.monotonic())
+                self.parse_frames()
+        except TimeoutError:
+            if self.rtt:
+                self.rtt.timed_out(key)
+            raise
+        finally:
+            # late responses will be discarded
+            del self.sent[transaction_id]
+            if self.alone == transaction_id:
+                self.alone = None
+
+        response = self.responses.pop(transaction_id)
 
         logging.debug("← < %s > %s bytes", dump(response), len(response))
 
-        return self.protocol.parse_response_adu(response, request)
+        stats = self.stats
+        if not stats:
+            return self.protocol.parse_response_adu(response, request)
+
+        start = time.perf_counter()
+        try:
+            return self.protocol.parse_response_adu(response, request)
+        except ModbusError:
+            stats.count(request[7], 'exceptions')
+            raise
+        finally:
+            stats.add_time('decode', start)
+
+    def fill(self, function, timeout):
+        """Receive what's available into the buffer, waiting up to timeout seconds for at least a byte"""
+        if len(self.buffer) - self.end < MAX_ADU_SIZE:
+            # make room at the end, moving what's left of a partial frame
+            # to the start
+            pending = self.end - self.start
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+
+        stats = self.stats
+        if stats:
+            start = time.perf_counter()
+            # waiting for a response, or for the rest of one
+            phase = 'wait' if self.start == self.end else 'receive'
+
+        timeout = max(0, timeout)
+        if not select.select([self.connection], [], [], timeout)[0]:
+            if stats:
+                stats.count(function, 'timeouts')
+            raise TimeoutError("No response from {} within {:g}s".format(self.host, timeout))
+
+        if stats:
+            start = stats.add_time(phase, start)
+
+        n = self.connection.recv_into(self.view[self.end:])
+        self.arrival = time.monotonic()
+
+        if stats:
+            stats.add_time('receive', start)
+
+        if n == 0:
+            raise ConnectionError("Connection closed by {}".format(self.host))
+        self.end += n
 
-    def receive_n(self, n):
-        data = bytes()
-        while len(data) < n:
-            len_before = len(data)
-            data += self.connection.recv(n - len(data))
-            if len(data) == len_before:
-                time.sleep(0.1)
-        return data
+    def parse_frames(self):
+        """Move all the complete frames in the buffer to the responses"""
+        buffer = self.buffer
+
+        while self.end - self.start >= 6:
+            seq, _, count = struct.unpack_from(">3H", buffer, self.start)
+            if not 2 <= count <= MAX_ADU_SIZE - 6:
+                logging.warning("Invalid MBAP header < %s >, discarding what was received",
+                                dump(buffer[self.start:self.start + 6]))
+                self.start = self.end = 0
+                return
+
+            end = self.start + 6 + count
+            if end > self.end:
+                break
+            response = bytes(buffer[self.start:end])
+            self.start = end
+
+            if self.stats:
+                self.stats.count(response[7] & 0x7f, 'bytes received', len(response))
+
+            self.last_arrival = self.arrival
+
+            if seq not in self.sent:
+                logging.warning("Unexpected transaction id %s, discarding response", seq)
+                continue
+
+            if self.rtt and seq == self.alone:
+                # the same key as in receive
+                key = '{}:{}/{}/{}'.format(self.host, self.port, response[6], response[7] & 0x7f)
+                self.rtt.sample(key, self.arrival - self.sent[seq])
+
+            self.responses[seq] = response
+
+        if self.start == self.end:
+            self.start = self.end = 0
 
     def close(self):
-        self.connection.close()
+        if self.connection:
+            self.connection.close()
+
+    def reconnect(self):
+        if self.connection:
+            try:
+                self.connection.close()
+            except OSError:
+                pass
+        # the responses to what was in flight are lost with the connection
+        self.sent.clear()
+        self.responses.clear()
+        self.alone = None
+        self.connect()
+        self.broken = False
 
     def perform_accesses(self, accesses, definitions):
-        for access in accesses:
-            if access.write:
-                access.write_registers_send(self)
-            else:
-                access.read_registers_send(self)
-
-        for access in accesses:
-            if access.write:
-                access.write_registers_receive(self)
-            else:
-                access.read_registers_receive(self)
-                access.print_values(definitions)
+        window = self.window or len(accesses)
+        sent = 0
+        received = 0
+        attempt = 0
+
+        while received < len(accesses):
+            access = accesses[received]
+
+            try:
+                if self.broken:
+                    self.reconnect()
+                    # replay what was in flight, the results received so far are kept
+                    sent = received
+
+                # keep up to window transactions in flight
+                for pending in accesses[sent:received + window]:
+                    if pending.write:
+                        pending.write_registers_send(self)
+                    else:
+                        pending.read_registers_send(self)
+                sent = max(sent, received + window)
+
+                if access.write:
+                    access.write_registers_receive(self)
+                else:
+                    access.read_registers_receive(self)
+            except OSError as e:
+                # timeouts included: the connection might be stuck, and late
+                # responses would get in the way of the retries
+                self.broken = True
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                wait_before_retry(self, access.request[7] if access.request else None, attempt, e)
+                continue
+
+            received += 1
+            attempt = 0
+
+            if not access.write:
+                if self.stats:
+                    start = time.perf_counter()
+                    self.output.write(access, definitions, self.tag)
+                    self.stats.add_time('output', start)
+                else:
+                    self.output.write(access, definitions, self.tag)
 
         return self
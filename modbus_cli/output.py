@@ -0,0 +1,152 @@
+import io
+import csv
+import json
+import time
+import threading
+from functools import partial
+
+
+class Changes:
+    """Report by exception: tell which values changed since last reported
+
+    Numeric values must change by more than their deadband, the one of their
+    register definition or the default one."""
+
+    def __init__(self, definitions, deadband=None):
+        self.definitions = definitions
+        self.deadband = deadband
+        # last value reported, by device and label
+        self.last = {}
+        # devices can be accessed concurrently
+        self.lock = threading.Lock()
+
+    def changed(self, tag, label, value):
+        key = tag, label
+
+        with self.lock:
+            if key in self.last and not self.exceeds_deadband(label, self.last[key], value):
+                return False
+
+            self.last[key] = value
+            return True
+
+    def exceeds_deadband(self, label, last, value):
+        numbers = (int, float)
+        if not isinstance(value, numbers) or not isinstance(last, numbers):
+            return value != last
+
+        register = self.definitions.registers.get(label) if self.definitions else None
+        deadband = register.deadband if register and register.deadband else self.deadband
+        if not deadband:
+            return value != last
+
+        amount = abs(last) * deadband.amount / 100 if deadband.relative else deadband.amount
+        return abs(value - last) > amount
+
+
+def changed_filter(changes, tag):
+    """The changed(label, value) filter of Access.format_values, None to output all the values"""
+    return partial(changes.changed, tag) if changes else None
+
+
+class LogOutput:
+    """Human readable output, through logging"""
+
+    def __init__(self, tagged=False, changes=None):
+        self.tagged = tagged
+        self.changes = changes
+
+    def write(self, access, definitions, tag=None, timestamp=None):
+        access.print_values(definitions, tag if self.tagged else None, changed_filter(self.changes, tag))
+
+    def flush(self):
+        pass
+
+
+class TextOutput:
+    """Human readable output, to a stream"""
+
+    def __init__(self, stream, changes=None):
+        self.stream = stream
+        self.changes = changes
+
+    def write(self, access, definitions, tag=None, timestamp=None):
+        for line in access.format_values(definitions, changed_filter(self.changes, tag)):
+            self.stream.write(line + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+
+def escape_influx(s):
+    return str(s).replace(',', r'\,').replace('=', r'\=').replace(' ', r'\ ')
+
+
+def influx_field(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return '{}i'.format(value)
+    if isinstance(value, float):
+        return repr(value)
+    return json.dumps(str(value))
+
+
+def format_jsonl(out, timestamp, device, label, words, value):
+    if isinstance(value, tuple):
+        value = list(value)
+    out.write(json.dumps({'time': timestamp, 'device': device, 'label': label, 'words': words, 'value': value}))
+    out.write('\n')
+
+
+def format_csv(out, timestamp, device, label, words, value):
+    if isinstance(value, tuple):
+        value = ' '.join(str(v) for v in value)
+    csv.writer(out, lineterminator='\n').writerow([timestamp, device, label, ' '.join(str(w) for w in words), value])
+
+
+def format_influx_line(out, timestamp, device, label, words, value):
+    if isinstance(value, tuple):
+        fields = ','.join('value{}={}'.format(i, influx_field(v)) for i, v in enumerate(value))
+    else:
+        fields = 'value={}'.format(influx_field(value))
+    out.write('modbus,device={},label={} {},words="{}" {}\n'.format(
+        escape_influx(device), escape_influx(label), fields, ' '.join(str(w) for w in words),
+        int(timestamp * 1e9)))
+
+
+FORMATS = {
+    'jsonl': format_jsonl,
+    'csv': format_csv,
+    'influx-line': format_influx_line,
+}
+
+
+class RecordOutput:
+    """Machine readable output, one record per value
+
+    Records are buffered and written to the stream only when flushed, i.e.
+    once per cycle."""
+
+    def __init__(self, stream, format, changes=None):
+        self.stream = stream
+        self.format_record = FORMATS[format]
+        self.changes = changes
+        self.buffer = io.StringIO()
+        # devices can be accessed concurrently
+        self.lock = threading.Lock()
+
+    def write(self, access, definitions, tag=None, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            for label, words, value in access.records():
+                if self.changes and not self.changes.changed(tag, label, value):
+                    continue
+                self.format_record(self.buffer, timestamp, tag, label, words, value)
+
+    def flush(self):
+        with self.lock:
+            self.stream.write(self.buffer.getvalue())
+            self.stream.flush()
+            self.buffer = io.StringIO()
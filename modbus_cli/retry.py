@@ -0,0 +1,55 @@
+import logging
+import time
+
+# longest wait between two attempts, in seconds
+MAX_BACKOFF = 10
+
+
+def backoff_delay(backoff, attempt):
+    """The wait before the attempt-th retry, doubling each time"""
+    return min(MAX_BACKOFF, backoff * 2 ** (attempt - 1))
+
+
+def wait_before_retry(modbus, function, attempt, error):
+    """Log, count and wait before retrying a request with the given function code"""
+    delay = backoff_delay(modbus.backoff, attempt)
+    prefix = '{}: '.format(modbus.tag) if modbus.tag else ''
+    logging.warning('%s%s, retrying in %.2gs (%d/%d)', prefix, str(error) or type(error).__name__, delay,
+                    attempt, modbus.retries)
+    if modbus.stats and function is not None:
+        modbus.stats.count(function, 'retries')
+    time.sleep(delay)
+
+
+class CircuitBreaker:
+    """Stop accessing a device that keeps failing
+
+    After threshold consecutive failed cycles the device is down: it's not
+    accessed at all for cooldown seconds, then it's tried once again."""
+
+    def __init__(self, threshold=3, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        # when the device can be tried again, None while it's up
+        self.down_until = None
+
+    def allow(self, now=None):
+        if self.down_until is None:
+            return True
+        return (time.monotonic() if now is None else now) >= self.down_until
+
+    def success(self):
+        """Record a successful cycle, return whether the device was down"""
+        was_down = self.down_until is not None
+        self.failures = 0
+        self.down_until = None
+        return was_down
+
+    def failure(self, now=None):
+        """Record a failed cycle, return whether the device is now down"""
+        self.failures += 1
+        if self.failures < self.threshold:
+            return False
+        self.down_until = (time.monotonic() if now is None else now) + self.cooldown
+        return True
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import threading
+
+# gains and variance factor from RFC 6298 (computing TCP's retransmission timer)
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+
+class Rtt:
+    """Response time estimates, to derive timeouts from
+
+    For each key (device, slave id and function code) a smoothed response
+    time and its variation are kept, as TCP does for its retransmission
+    timeout. The timeout is the smoothed time plus four times its variation,
+    within min_timeout and max_timeout. It's max_timeout for keys without
+    samples, and it doubles after each timeout until a response is received."""
+
+    def __init__(self, min_timeout, max_timeout):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        # key -> [smoothed response time, variation, backoff]
+        self.estimates = {}
+        self.lock = threading.Lock()
+
+    def timeout(self, key):
+        with self.lock:
+            estimate = self.estimates.get(key)
+            if estimate is None:
+                return self.max_timeout
+            srtt, rttvar, backoff = estimate
+        return min(self.max_timeout, max(self.min_timeout, srtt + K * rttvar) * backoff)
+
+    def sample(self, key, rtt):
+        with self.lock:
+            estimate = self.estimates.get(key)
+            if estimate is None:
+                self.estimates[key] = [rtt, rtt / 2, 1]
+                return
+            srtt, rttvar, _ = estimate
+            rttvar = (1 - BETA) * rttvar + BETA * abs(srtt - rtt)
+            srtt = (1 - ALPHA) * srtt + ALPHA * rtt
+            self.estimates[key] = [srtt, rttvar, 1]
+
+    def timed_out(self, key):
+        with self.lock:
+            estimate = self.estimates.get(key)
+            if estimate is not None:
+                estimate[2] *= 2
+
+    def load(self, filename):
+        try:
+            with open(filename) as f:
+                estimates = {key: [float(srtt), float(rttvar), 1] for key, (srtt, rttvar) in json.load(f).items()}
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logging.debug('No response times from %s: %s', filename, e)
+            return
+
+        with self.lock:
+            for key, estimate in estimates.items():
+                self.estimates.setdefault(key, estimate)
+
+    def save(self, filename):
+        with self.lock:
+            estimates = {key: [srtt, rttvar] for key, (srtt, rttvar, _) in self.estimates.items()}
+
+        try:
+            if os.path.dirname(filename):
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                json.dump(estimates, f, indent=1, sort_keys=True)
+        except OSError as e:
+            logging.debug('Could not save the response times to %s: %s', filename, e)
@@ -0,0 +1,101 @@
+import math
+import time
+import fnmatch
+import logging
+
+from .access import group_accesses
+
+
+def scan_periods(accesses, definitions, default_period, patterns=()):
+    """Sort accesses to single registers by scan period
+
+    The period of a register is the last of patterns, a list of (glob pattern,
+    period), matching its name or address, else the one of its definition,
+    else default_period."""
+    periods = {}
+
+    for access in accesses:
+        name = access.names[0]
+        label = name if name is not None else str(access.address())
+
+        period = None
+        for pattern, pattern_period in patterns:
+            if fnmatch.fnmatchcase(label, pattern):
+                period = pattern_period
+        if period is None and name is not None and definitions:
+            period = definitions.registers[name].scan
+        if period is None:
+            period = default_period
+
+        periods.setdefault(period, []).append(access)
+
+    return periods
+
+
+class ScanClass:
+    """Registers read at the same period"""
+
+    def __init__(self, period, accesses):
+        self.period = period
+        # single register accesses, grouped by Scheduler
+        self.accesses = accesses
+        self.next_due = None
+        self.scans = 0
+        self.misses = 0
+
+    def __str__(self):
+        return 'once' if self.period == math.inf else '{}s'.format(self.period)
+
+    def due(self, now, tolerance):
+        if self.next_due is None:
+            self.next_due = now + self.period
+            return True
+
+        if now + tolerance < self.next_due:
+            return False
+
+        # whole periods this class is late by, i.e. deadlines missed
+        late = math.floor((now - self.next_due) / self.period)
+        if late > 0:
+            self.misses += late
+            logging.warning('Scan class %s missed %d deadline(s), %d so far', self, late, self.misses)
+        else:
+            late = 0
+
+        self.next_due += (late + 1) * self.period
+        return True
+
+
+class Scheduler:
+    """Multi-rate scan: at each tick access only the registers that are due
+
+    tick is the interval between ticks; periods should be multiples of it."""
+
+    def __init__(self, periods, tick, max_gap=0, illegal_gaps=()):
+        self.classes = [ScanClass(period, accesses) for period, accesses in sorted(periods.items())]
+        self.tolerance = tick / 2
+        self.max_gap = max_gap
+        self.illegal_gaps = illegal_gaps
+        # grouped plans, by scan classes due
+        self.plans = {}
+
+    def tick(self, now=None):
+        """The scan classes due and the plan to access them"""
+        if now is None:
+            now = time.monotonic()
+
+        due = tuple(c for c in self.classes if c.due(now, self.tolerance))
+        for c in due:
+            c.scans += 1
+
+        if due not in self.plans:
+            # grouping appends to the accesses, don't touch the originals
+            accesses = [access.copy() for c in due for access in c.accesses]
+            self.plans[due] = group_accesses(accesses, self.max_gap, self.illegal_gaps)
+
+        return due, self.plans[due]
+
+    def report(self, tag=None):
+        for c in self.classes:
+            logging.info('%sScan class %s: %d scans, %d deadline misses',
+                         '{} '.format(tag) if tag else '', c, c.scans, c.misses)
@@ -0,0 +1,201 @@
+import argparse
+import io
+import logging
+import os
+import shlex
+import socket
+import socketserver
+import stat
+import threading
+
+from .access import error_message, group_accesses, parse_accesses
+from .output import TextOutput, RecordOutput, FORMATS
+from .target import Target
+
+
+class RequestError(Exception):
+    pass
+
+
+class RequestParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise RequestError(message)
+
+
+def request_parser():
+    """The options accepted by the server, a subset of the command line ones"""
+    parser = RequestParser(prog='modbus', add_help=False)
+    parser.add_argument('-s', '--slave-id', type=int)
+    parser.add_argument('-S', '--silent', action='store_true')
+    parser.add_argument('-B', '--byte-order', choices=['le', 'be', 'mixed'], default='be')
+    parser.add_argument('--max-gap', type=int, default=0)
+    parser.add_argument('-f', '--format', choices=sorted(FORMATS))
+    parser.add_argument('device')
+    parser.add_argument('access', nargs='+')
+    return parser
+
+
+def make_request(args):
+    """The request line for the command line arguments args"""
+    argv = ['-B', args.byte_order, '--max-gap', str(args.max_gap)]
+    if args.slave_id is not None:
+        argv += ['-s', str(args.slave_id)]
+    if args.silent:
+        argv.append('-S')
+    if args.format:
+        argv += ['-f', args.format]
+    return shlex.join(argv + [args.device] + args.access) + '\n'
+
+
+class Device:
+    """A device, its connection and what's been learned about it"""
+
+    def __init__(self, name, connect):
+        self.name = name
+        self.connect = connect
+        # requests for the device take turns on its connection
+        self.lock = threading.Lock()
+        self.modbus = None
+        self.default_slave_id = None
+        # see Target.illegal_gaps
+        self.illegal_gaps = set()
+
+    def connection(self):
+        """The connection to the device, opened if needed, to be used holding the lock"""
+        if self.modbus is None:
+            self.modbus = self.connect(self.name)
+            self.default_slave_id = self.modbus.slave_id
+        return self.modbus
+
+    def discard(self):
+        """Close the connection, it will be opened again by the next request"""
+        modbus, self.modbus = self.modbus, None
+        if modbus:
+            modbus.close()
+
+
+class Pool:
+    """The devices requests were made for, with their connections kept open"""
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        # connecting takes time, it's up to the device (and its lock) so that
+        # requests for the other devices aren't held up meanwhile
+        with self.lock:
+            device = self.devices.get(name)
+            if device is None:
+                device = self.devices[name] = Device(name, self.connect)
+            return device
+
+    def close(self):
+        with self.lock:
+            devices = list(self.devices.values())
+        for device in devices:
+            device.discard()
+
+
+def is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        out = io.StringIO()
+        try:
+            line = self.rfile.readline().decode()
+            self.server.perform(self.server.parser.parse_args(shlex.split(line)), out)
+        except Exception as e:
+            logging.error('%s', e)
+            out.write('error: {}\n'.format(e))
+        self.wfile.write(out.getvalue().encode())
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answer the requests made on a unix socket, keeping the connections to
+    the devices open between them
+
+    A request is a single line with the same syntax as the command line,
+    the answer is the output of the accesses, followed by an error line for
+    each one the device rejected."""
+
+    daemon_threads = True
+
+    def __init__(self, path, connect, definitions):
+        if is_socket(path):
+            # left behind by a server that didn't stop cleanly
+            os.unlink(path)
+        elif os.path.lexists(path):
+            raise ValueError('{} exists and is not a socket, not replacing it'.format(path))
+        super().__init__(path, Handler)
+        self.path = path
+        self.pool = Pool(connect)
+        self.definitions = definitions
+        self.parser = request_parser()
+
+    def server_bind(self):
+        # requests can write to the devices, only the owner may make them,
+        # from the moment the socket is created
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def perform(self, args, out):
+        accesses = parse_accesses(args.access, self.definitions, args.byte_order, args.silent, group=False)
+
+        if args.format:
+            output = RecordOutput(out, args.format)
+        else:
+            output = TextOutput(out)
+
+        device = self.pool.get(args.device)
+        with device.lock:
+            try:
+                modbus = device.connection()
+                target = Target(args.device, args.slave_id, group_accesses(accesses, args.max_gap, device.illegal_gaps))
+                if target.slave_id is None:
+                    target.slave_id = device.default_slave_id
+                target.illegal_gaps = device.illegal_gaps
+                modbus.output = output
+                target.modbus = modbus
+                rejected = target.perform(self.definitions)
+            except (OSError, EOFError):
+                # reconnect on the next request
+                device.discard()
+                raise
+            finally:
+                output.flush()
+
+        for access in rejected:
+            out.write('error: {} rejected: {}\n'.format(access, error_message(access.error)))
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+        if is_socket(self.path):
+            os.unlink(self.path)
+
+
+def query(path, request):
+    """Send a request to the server listening on path, return its answer"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(request.encode())
+        s.shutdown(socket.SHUT_WR)
+
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    return b''.join(chunks).decode()
@@ -0,0 +1,265 @@
+"""A Modbus slave, for tests and benchmarks
+
+Simulator answers the requests from a register image and injects latency,
+jitter and errors. TcpSimulator and RtuSimulator serve it on a local TCP
+socket and on a pty."""
+
+import array
+import os
+import queue
+import random
+import select
+import socket
+import struct
+import threading
+import time
+import tty
+
+from umodbus.client.serial.redundancy_check import add_crc, get_crc
+
+from .modbus_rtu import ModbusRtu
+from .modbus_tcp import ModbusTcp
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+SLAVE_DEVICE_FAILURE = 4
+
+# the table each function code accesses
+TABLES = {1: 'c', 2: 'd', 3: 'h', 4: 'i', 5: 'c', 6: 'h', 15: 'c', 16: 'h'}
+
+
+class Simulator:
+    """The register image of a slave and how it misbehaves
+
+    Registers initially contain their address, coils and discrete inputs
+    their address modulo 2. Reading or writing any of the (modbus type,
+    address) in illegal is an illegal data address. Each response is
+    delayed by latency plus up to jitter seconds, a fraction error_rate of
+    the requests fails with a slave device failure and a fraction drop_rate
+    isn't answered at all."""
+
+    def __init__(self, size=0x10000, latency=0, jitter=0, error_rate=0, drop_rate=0, seed=None):
+        self.tables = {
+            'c': bytearray(address % 2 for address in range(size)),
+            'd': bytearray(address % 2 for address in range(size)),
+            'h': array.array('H', range(size)),
+            'i': array.array('H', range(size)),
+        }
+        self.illegal = set()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def respond(self, pdu):
+        """The delay and the response PDU to a request PDU, None for no response"""
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            if self.random.random() < self.drop_rate:
+                return delay, None
+            if self.random.random() < self.error_rate:
+                return delay, exception(pdu[0], SLAVE_DEVICE_FAILURE)
+            try:
+                return delay, self.execute(pdu)
+            except (struct.error, IndexError):
+                return delay, exception(pdu[0], ILLEGAL_DATA_ADDRESS)
+
+    def check(self, table, address, quantity):
+        if address + quantity > len(self.tables[table]) or any(
+                (table, a) in self.illegal for a in range(address, address + quantity)):
+            raise IndexError(address)
+
+    def execute(self, pdu):
+        function = pdu[0]
+        if function not in TABLES:
+            return exception(function, ILLEGAL_FUNCTION)
+        table = TABLES[function]
+        address, value = struct.unpack_from('>HH', pdu, 1)
+
+        if function in (1, 2):
+            self.check(table, address, value)
+            bits = self.tables[table][address:address + value]
+            data = bytearray((value + 7) // 8)
+            for n, bit in enumerate(bits):
+                data[n // 8] |= bit << (n % 8)
+            return struct.pack('>BB', function, len(data)) + data
+        if function in (3, 4):
+            self.check(table, address, value)
+            words = self.tables[table][address:address + value]
+            return struct.pack('>BB{}H'.format(value), function, 2 * value, *words)
+        if function == 5:
+            self.check(table, address, 1)
+            self.tables[table][address] = value == 0xff00
+        elif function == 6:
+            self.check(table, address, 1)
+            self.tables[table][address] = value
+        elif function == 15:
+            self.check(table, address, value)
+            data = pdu[6:6 + pdu[5]]
+            for n in range(value):
+                self.tables[table][address + n] = (data[n // 8] >> (n % 8)) & 1
+        else:
+            self.check(table, address, value)
+            self.tables[table][address:address + value] = array.array(
+                'H', struct.unpack_from('>{}H'.format(value), pdu, 6))
+
+        return pdu[:5]
+
+
+def exception(function, code):
+    return bytes([function | 0x80, code])
+
+
+class TcpSimulator:
+    """Serve a Simulator on a local TCP socket, see device
+
+    Requests are answered as soon as they arrive, each after its own delay,
+    as over a link with that latency: pipelined requests overlap."""
+
+    def __init__(self, simulator, host='127.0.0.1', port=0):
+        self.simulator = simulator
+        self.socket = socket.create_server((host, port))
+        host, port = self.socket.getsockname()[:2]
+        self.device = '{}:{}'.format(host, port)
+        self.connections = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def connect(self, timeout=5, window=None, stats=None):
+        """A connection to the simulator, see Stats for stats"""
+        host, port = self.device.split(':')
+        modbus = ModbusTcp(host, int(port), None, timeout, window)
+        modbus.stats = stats
+        modbus.connect()
+        return modbus
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections.append(connection)
+            threading.Thread(target=self.handle, args=(connection, ), daemon=True).start()
+
+    def handle(self, connection):
+        responses = queue.Queue()
+        threading.Thread(target=self.answer, args=(connection, responses), daemon=True).start()
+
+        stream = connection.makefile('rb')
+        try:
+            while True:
+                header = stream.read(7)
+                if len(header) < 7:
+                    break
+                transaction_id, _, length, unit_id = struct.unpack('>HHHB', header)
+                delay, response = self.simulator.respond(stream.read(length - 1))
+                if response is not None:
+                    responses.put((time.monotonic() + delay,
+                                   struct.pack('>HHHB', transaction_id, 0, len(response) + 1, unit_id) + response))
+        except OSError:
+            pass
+        finally:
+            responses.put(None)
+
+    def answer(self, connection, responses):
+        while True:
+            item = responses.get()
+            if item is None:
+                break
+            due, adu = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                connection.sendall(adu)
+            except OSError:
+                break
+
+    def close(self):
+        self.socket.shutdown(socket.SHUT_RDWR)
+        self.socket.close()
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+
+def request_length(frame):
+    """The length of the RTU request frame starting at frame[0], None if unknown yet"""
+    if len(frame) < 2:
+        return None
+    if frame[1] in (15, 16):
+        return 9 + frame[6] if len(frame) >= 7 else None
+    if frame[1] in TABLES:
+        return 8
+    # unknown function, take whatever there is
+    return len(frame)
+
+
+class RtuSimulator:
+    """Serve a Simulator as the slave slave_id (any if None) on a pty, see device
+
+    The serial line is half duplex: each request is answered after its delay,
+    before reading the next one."""
+
+    def __init__(self, simulator, slave_id=None):
+        self.simulator = simulator
+        self.slave_id = slave_id
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.device = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def connect(self, timeout=5, baud=115200):
+        """A connection to the simulator"""
+        modbus = ModbusRtu(self.device, baud, 'n', 1, None, timeout)
+        modbus.connect()
+        return modbus
+
+    def serve(self):
+        frame = bytearray()
+
+        while self.running:
+            if not select.select([self.master], [], [], 0.05)[0]:
+                # silence, whatever is left is garbage
+                frame.clear()
+                continue
+            try:
+                frame += os.read(self.master, 256)
+            except OSError:
+                return
+
+            while True:
+                length = request_length(frame)
+                if length is None or len(frame) < length:
+                    break
+                request = bytes(frame[:length])
+                del frame[:length]
+
+                if request[-2:] != get_crc(request[:-2]):
+                    frame.clear()
+                    break
+                if self.slave_id is not None and request[0] != self.slave_id:
+                    continue
+
+                delay, response = self.simulator.respond(request[1:-2])
+                if response is None or request[0] == 0:
+                    # no answers to broadcasts
+                    continue
+                time.sleep(delay)
+                os.write(self.master, add_crc(bytes([request[0]]) + response))
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
@@ -0,0 +1,88 @@
+import json
+import logging
+import threading
+import time
+
+# where the time goes, in the order of a transaction
+PHASES = ('dns', 'connect', 'plan', 'send', 'wait', 'receive', 'decode', 'output')
+
+COUNTERS = ('requests', 'bytes sent', 'bytes received', 'retries', 'timeouts', 'exceptions')
+
+FUNCTIONS = {
+    1: 'read coils',
+    2: 'read discrete inputs',
+    3: 'read holding registers',
+    4: 'read input registers',
+    5: 'write single coil',
+    6: 'write single register',
+    15: 'write multiple coils',
+    16: 'write multiple registers',
+}
+
+# the function code reading each modbus type
+READ_FUNCTIONS = {'c': 1, 'C': 1, 'd': 2, 'h': 3, 'H': 3, 'i': 4}
+
+
+class Stats:
+    """Time spent in each phase and counters for each function code
+
+    Transports and targets update the Stats they are given, if any: when
+    there are none the only cost is checking for them. The phases are
+
+    dns, connect   resolving the host name and opening the connection
+    plan           grouping the accesses into operations
+    send           writing a request
+    wait           waiting for the first bytes of a response
+    receive        reading the rest of the response
+    decode         parsing the response and unpacking the values
+    output         printing the values"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # phase -> [count, total seconds, max seconds]
+        self.timers = {phase: [0, 0.0, 0.0] for phase in PHASES}
+        # function code -> counter -> count
+        self.counters = {}
+
+    def add_time(self, phase, start):
+        """Account the time elapsed since start (a perf_counter()) to phase, return the current time"""
+        now = time.perf_counter()
+        elapsed = now - start
+        with self.lock:
+            timer = self.timers[phase]
+            timer[0] += 1
+            timer[1] += elapsed
+            timer[2] = max(timer[2], elapsed)
+        return now
+
+    def count(self, function, counter, n=1):
+        with self.lock:
+            counters = self.counters.setdefault(function, dict.fromkeys(COUNTERS, 0))
+            counters[counter] += n
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'phases': {phase: {'count': count, 'total': total, 'max': longest}
+                           for phase, (count, total, longest) in self.timers.items() if count},
+                'functions': {str(function): dict(counters) for function, counters in sorted(self.counters.items())},
+            }
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+            f.write('\n')
+
+    def report(self):
+        stats = self.as_dict()
+
+        logging.info('{:<10}{:>10}{:>12}{:>12}{:>12}'.format('phase', 'count', 'total s', 'mean ms', 'max ms'))
+        for phase, timer in stats['phases'].items():
+            logging.info('{:<10}{:>10}{:>12.3f}{:>12.3f}{:>12.3f}'.format(
+                phase, timer['count'], timer['total'], 1000 * timer['total'] / timer['count'], 1000 * timer['max']))
+
+        if stats['functions']:
+            logging.info('{:<28}'.format('function') + ''.join('{:>16}'.format(c) for c in COUNTERS))
+        for function, counters in stats['functions'].items():
+            name = '{} {}'.format(function, FUNCTIONS.get(int(function), ''))
+            logging.info('{:<28}'.format(name) + ''.join('{:>16}'.format(counters[c]) for c in COUNTERS))
@@ -0,0 +1,131 @@
+import logging
+import time
+
+from .access import unbridge_illegal_gaps
+from .stats import READ_FUNCTIONS
+
+
+def perform(modbus, accesses, definitions):
+    """Perform the accesses, returning the plan to use for the next cycle"""
+    modbus.perform_accesses(accesses, definitions)
+
+    accesses, retry = unbridge_illegal_gaps(accesses)
+    if retry:
+        logging.debug('Invalid address while bridging gaps, retrying without')
+        if modbus.stats:
+            for access in retry:
+                modbus.stats.count(READ_FUNCTIONS[access.modbus_type], 'retries')
+        modbus.perform_accesses(retry, definitions)
+
+    return accesses
+
+
+class Target:
+    """The accesses to perform on a device"""
+
+    def __init__(self, device, slave_id, accesses):
+        self.device = device
+        self.slave_id = slave_id
+        self.accesses = accesses
+        if slave_id is None:
+            self.tag = device
+        else:
+            self.tag = '{}/{}'.format(device, slave_id)
+        self.modbus = None
+        # registers not to read to bridge gaps, see group_accesses
+        self.illegal_gaps = set()
+        # whether the device didn't answer during the last cycle
+        self.timed_out = False
+        # for multi-rate scans, see Scheduler
+        self.scheduler = None
+        # when polling, see CircuitBreaker
+        self.breaker = None
+
+    @property
+    def serial(self):
+        return self.device[0] == '/'
+
+    def perform(self, definitions):
+        """Perform the accesses due, returning those the device answered with an exception"""
+        # targets on the same serial port share the connection
+        self.modbus.slave_id = self.slave_id
+        self.modbus.illegal_gaps = self.illegal_gaps
+        self.modbus.tag = self.tag
+
+        if self.scheduler:
+            stats = self.modbus.stats
+            if stats:
+                start = time.perf_counter()
+            due, plan = self.scheduler.tick()
+            if stats:
+                stats.add_time('plan', start)
+            plan = self.scheduler.plans[due] = perform(self.modbus, plan, definitions)
+        else:
+            plan = self.accesses = perform(self.modbus, self.accesses, definitions)
+
+        return [access for access in plan if access.error]
+
+
+def perform_targets(targets, definitions, polling=False):
+    """Perform the accesses of targets sharing a connection, one at a time
+
+    A serial target that doesn't answer is skipped when there are others on
+    the bus or when polling, and during the next cycle it's accessed after
+    all the others so that it doesn't delay them. Targets
+    with a circuit breaker aren't accessed at all while they are down.
+
+    Returns the targets that failed: not accessed, not answering, or
+    answering some of the accesses with an exception (which still counts
+    as an answer for the circuit breaker)."""
+    failed = []
+
+    for target in sorted(targets, key=lambda target: target.timed_out):
+        breaker = target.breaker
+        if breaker and not breaker.allow():
+            failed.append(target)
+            continue
+
+        try:
+            rejected = target.perform(definitions)
+        except OSError as e:
+            if isinstance(e, TimeoutError) and target.serial and (len(targets) > 1 or polling):
+                logging.error('%s: timeout, skipping it', target.tag)
+                target.timed_out = True
+            elif breaker:
+                logging.error('%s: %s', target.tag, str(e) or type(e).__name__)
+            else:
+                raise
+            failed.append(target)
+            if breaker and breaker.failure():
+                logging.error('%s: down, not accessing it for %gs', target.tag, breaker.cooldown)
+        else:
+            target.timed_out = False
+            if rejected:
+                failed.append(target)
+            if breaker and breaker.success():
+                logging.warning('%s: back up', target.tag)
+
+    return failed
+
+
+def parse_targets(filename):
+    """Parse a targets file
+
+    Each line contains a device, a slave id (or - for the default one) and
+    one or more accesses, separated by spaces. A # starts a comment."""
+    targets = []
+
+    with open(filename) as f:
+        for n, line in enumerate(f, 1):
+            parts = line.split('#')[0].split()
+            if not parts:
+                continue
+
+            if len(parts) < 3:
+                logging.warning('%s:%d:Invalid target %r. Skipping it.', filename, n, line.strip())
+                continue
+
+            device, slave_id, *accesses = parts
+            targets.append((device, None if slave_id == '-' else int(slave_id, 0), accesses))
+
+    return targets
@@ -22,6 +22,7 @@ setup(name='modbus_cli',
           ],
       },
       install_requires=['umodbus', 'colorama'],
+      extras_require={'numpy': ['numpy']},
       zip_safe=False,
       classifiers=[
           'Development Status :: 4 - Beta',
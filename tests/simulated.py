@@ -0,0 +1,16 @@
+"""Setup shared by the tests against the simulator"""
+
+from modbus_cli.benchmark import Discard
+from modbus_cli.simulator import TcpSimulator
+
+
+def simulated_tcp(test, simulator, timeout=5, window=None, stats=None):
+    """Serve simulator and connect to it, until the end of test
+
+    Returns the TcpSimulator and the connection, which discards the values."""
+    server = TcpSimulator(simulator)
+    test.addCleanup(server.close)
+    modbus = server.connect(timeout, window, stats)
+    test.addCleanup(modbus.close)
+    modbus.output = Discard()
+    return server, modbus
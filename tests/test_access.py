@@ -2,23 +2,27 @@ import unittest
 from unittest.mock import Mock
 import logging
 
-from modbus_cli.access import parse_accesses, Access
+import umodbus.exceptions
+
+from modbus_cli.access import parse_accesses, group_accesses, unbridge_illegal_gaps, Access
 
 logging.basicConfig(level=logging.DEBUG)
 
 
 def mocked_modbus():
     modbus = Mock()
+    modbus.stats = None
     modbus.slave_id = 42
+    modbus.send = Mock(side_effect=lambda request: request)
 
     modbus.protocol = Mock()
-    modbus.protocol.read_input_registers = Mock(return_value=[])
-    modbus.protocol.read_holding_registers = Mock(return_value=[])
-    modbus.protocol.read_discrete_inputs = Mock(return_value=[])
-    modbus.protocol.read_coils = Mock(return_value=[])
+    modbus.protocol.read_input_registers = Mock(return_value=b'')
+    modbus.protocol.read_holding_registers = Mock(return_value=b'')
+    modbus.protocol.read_discrete_inputs = Mock(return_value=b'')
+    modbus.protocol.read_coils = Mock(return_value=b'')
 
-    modbus.protocol.write_multiple_registers = Mock(return_value=[])
-    modbus.protocol.write_multiple_coils = Mock(return_value=[])
+    modbus.protocol.write_multiple_registers = Mock(return_value=b'')
+    modbus.protocol.write_multiple_coils = Mock(return_value=b'')
 
     return modbus
 
@@ -69,6 +73,64 @@ class TestAccess(unittest.TestCase):
         self.assertEqual(None, it.presenter())
         self.assertEqual(2, it.size())
 
+    def test_grouping_max_quantity(self):
+        it = parse_accesses([str(n) for n in range(130)], None)
+        self.assertEqual([(0, 125), (125, 5)], [(a.address(), a.size()) for a in it])
+
+        it = parse_accesses(['c@{}'.format(n) for n in range(2001)], None)
+        self.assertEqual([(0, 2000), (2000, 1)], [(a.address(), a.size()) for a in it])
+
+        it = parse_accesses(['{}=1'.format(n) for n in range(124)], None)
+        self.assertEqual([(0, 123), (123, 1)], [(a.address(), a.size()) for a in it])
+
+        it = parse_accesses(['c@{}=1'.format(n) for n in range(1969)], None)
+        self.assertEqual([(0, 1968), (1968, 1)], [(a.address(), a.size()) for a in it])
+
+    def test_split_oversized(self):
+        it = parse_accesses(['i@0/200H'], None)
+        self.assertEqual([(0, '!125H'), (125, '!75H')], [(a.address(), a.pack_type()) for a in it])
+
+        it = parse_accesses(['i@0/70f'], None)
+        self.assertEqual([(0, '!62f'), (124, '!8f')], [(a.address(), a.pack_type()) for a in it])
+
+        with self.assertRaises(ValueError):
+            parse_accesses(['i@0/60I10H'], None)
+
+    def test_max_gap(self):
+        it = parse_accesses(['100', '102', '105/I', '110'], None, max_gap=2)
+        self.assertEqual([(100, 7), (110, 1)], [(a.address(), a.size()) for a in it])
+        self.assertEqual([100, 101, 102, 103, 105], it[0].addresses)
+
+        # writes are never bridged
+        it = parse_accesses(['100=1', '102=1'], None, max_gap=2)
+        self.assertEqual(2, len(it))
+
+        it = group_accesses([Access('h', [100], ['!H']), Access('h', [102], ['!H'])], 2, {('h', 101)})
+        self.assertEqual(2, len(it))
+
+    def test_read_bridged_gap(self):
+        modbus = mocked_modbus()
+        modbus.receive = Mock(return_value=[0x1234, 0xffff, 0xffff, 0x5678])
+        access, = parse_accesses(['100', '103'], None, max_gap=2)
+        access.perform(modbus)
+
+        modbus.protocol.read_holding_registers.assert_called_once_with(42, 100, 4)
+        self.assertEqual([(0x1234, ), (), (0x5678, )], access.values)
+
+    def test_read_illegal_gap(self):
+        modbus = mocked_modbus()
+        modbus.illegal_gaps = set()
+        modbus.receive = Mock(side_effect=umodbus.exceptions.IllegalDataAddressError)
+        access, = parse_accesses(['100', '103'], None, max_gap=2)
+        access.perform(modbus)
+
+        self.assertEqual({('h', 101), ('h', 102)}, modbus.illegal_gaps)
+        self.assertIsNone(access.values)
+
+        plan, retry = unbridge_illegal_gaps([access])
+        self.assertEqual(plan, retry)
+        self.assertEqual([(100, 1), (103, 1)], [(a.address(), a.size()) for a in plan])
+
     def test_read_input_registers(self):
         modbus = mocked_modbus()
         modbus.receive = Mock(return_value=[0x1234, 0x5678])
@@ -121,6 +183,14 @@ class TestAccess(unittest.TestCase):
         modbus.protocol.write_multiple_registers.assert_called_once_with(42, 123, [10, 11])
         modbus.send.assert_called_once()
 
+    def test_write_mixed_types(self):
+        modbus = mocked_modbus()
+        access, = parse_accesses(['100=1', '101/f=1.5', '103/i=-2'], None)
+        access.perform(modbus)
+
+        modbus.protocol.write_multiple_registers.assert_called_once_with(42, 100, [1, 0x3fc0, 0, 0xffff, 0xfffe])
+        self.assertEqual([1, 0x3fc0, 0, 0xffff, 0xfffe], access.encoded)
+
     def test_write_coils(self):
         modbus = mocked_modbus()
         access = Access('c', [123, 124], ['!B', '!B'], values=['1', '0'])
@@ -0,0 +1,99 @@
+import unittest
+import io
+import logging
+from unittest.mock import Mock
+
+from modbus_cli.access import Access, parse_accesses
+from modbus_cli.definitions import Definitions
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+else:
+    from modbus_cli.arrays import ArrayOutput, array_dtype, decode_array, plan_dtype
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def read(access, words, output=None):
+    modbus = Mock()
+    modbus.stats = None
+    modbus.output = output
+    modbus.receive = Mock(return_value=words)
+    access.read_registers_receive(modbus)
+    return access
+
+
+@unittest.skipUnless(numpy, 'NumPy is not installed')
+class TestArrays(unittest.TestCase):
+
+    def check(self, definition, byte_order, words):
+        access, = parse_accesses([definition], Definitions(True), byte_order)
+        read(access, words)
+        expected = [v for value in access.values for v in value]
+        self.assertEqual(expected, decode_array(access).tolist())
+
+    def test_byte_orders(self):
+        words = [0x3fc0, 0x0000, 0x4000, 0x1234, 0xc2c8, 0x0001]
+        for byte_order in ('be', 'le', 'mixed'):
+            self.check('i@0/3f', byte_order, words)
+            self.check('i@0/3i', byte_order, words)
+            self.check('i@0/6h', byte_order, words)
+            self.check('i@0/6H', byte_order, words)
+
+    def test_dtype(self):
+        self.assertEqual('>f4', array_dtype(Access('h', [0], ['!62f'])))
+        self.assertEqual('<u4', array_dtype(Access('h', [0, 2], ['<I', '<I'])))
+        self.assertEqual('u1', array_dtype(Access('c', [0, 1], ['!B', '!B'])))
+        self.assertIsNone(array_dtype(Access('h', [0, 1], ['!H', '!h'])))
+        self.assertIsNone(array_dtype(Access('h', [0], ['!4s'])))
+
+    def test_plan_dtype(self):
+        definitions = Definitions(True)
+        self.assertEqual('>f4', plan_dtype(parse_accesses(['i@0/f', 'h@10/2f', 'h@20=1'], definitions, group=False)))
+        self.assertIsNone(plan_dtype([]))
+        with self.assertRaises(ValueError):
+            plan_dtype(parse_accesses(['i@0/f', 'h@10/H'], definitions, group=False))
+        with self.assertRaises(ValueError):
+            plan_dtype(parse_accesses(['i@0/4s'], definitions, group=False))
+
+    def test_gaps(self):
+        access = read(Access('h', [0, 1, 2], ['!H', '2x', '!H']), [1, 2, 3])
+        self.assertEqual([1, 3], decode_array(access).tolist())
+
+        access = read(Access('c', [0, 1, 4], ['!B', '3x', '!B']), [1, 0, 0, 0, 1])
+        self.assertEqual([1, 1], decode_array(access).tolist())
+
+    def test_not_uniform(self):
+        with self.assertRaises(ValueError):
+            decode_array(read(Access('h', [0, 1], ['!H', '!h']), [1, 2]))
+
+    def test_output(self):
+        stream = io.BytesIO()
+        output = ArrayOutput(stream, 'npy')
+
+        for _ in range(2):
+            for address in (0, 2):
+                access = read(Access('h', [address], ['!2H']), [address, address + 1], output)
+                self.assertEqual((), access.values)
+                output.write(access, None)
+            output.flush()
+
+        stream.seek(0)
+        for _ in range(2):
+            self.assertEqual([0, 1, 2, 3], numpy.load(stream).tolist())
+
+        stream = io.BytesIO()
+        output = ArrayOutput(stream, 'raw')
+        output.write(read(Access('h', [0], ['<f']), [0x0000, 0x3fc0]), None)
+        output.flush()
+        self.assertEqual(b'\x00\x00\x3f\xc0', stream.getvalue())
+
+        with self.assertRaises(ValueError):
+            output.write(read(Access('h', [0], ['!H']), [1]), None)
+            output.write(read(Access('h', [0], ['!h']), [1]), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import Mock
+import io
+import logging
+import math
+
+from modbus_cli.bulk_write import parse_writes, write_from
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class TestBulkWrite(unittest.TestCase):
+
+    def test_parse_writes(self):
+        lines = io.StringIO('# a comment\n100 1\n101,2\n\nh@102/f 3.5\ninvalid\n')
+        self.assertEqual(['100=1', '101=2', 'h@102/f=3.5'], list(parse_writes(lines)))
+
+    def modbus(self):
+        def perform_accesses(accesses, definitions):
+            for access in accesses:
+                access.error = None
+
+        modbus = Mock()
+        modbus.perform_accesses = Mock(side_effect=perform_accesses)
+        return modbus
+
+    def test_write_from(self):
+        modbus = self.modbus()
+        lines = ('{} {}\n'.format(address, address) for address in range(300))
+        self.assertEqual((300, 3, 0), write_from(modbus, lines, None, batch_size=200))
+
+        # 123 registers from the first batch, the other 77 continued by the
+        # second one for another 123, and the last 54 once the lines are over
+        self.assertEqual([[123], [123], [54]], [[access.size() for access in call.args[0]]
+                                                for call in modbus.perform_accesses.call_args_list])
+
+    def test_across_batches(self):
+        modbus = self.modbus()
+        lines = ('{} {}\n'.format(address, address) for address in range(2500))
+        # as many full requests as fit, whatever the batch size
+        self.assertEqual((2500, math.ceil(2500 / 123), 0), write_from(modbus, lines, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import io
+import json
+import logging
+import os
+import tempfile
+
+from modbus_cli.access import parse_accesses
+from modbus_cli.capture import Capture, describe, replay
+from modbus_cli.definitions import Definitions
+from modbus_cli.output import RecordOutput
+from modbus_cli.simulator import Simulator
+
+from simulated import simulated_tcp
+
+logging.basicConfig(level=logging.DEBUG)
+
+ACCESSES = ['h@0/H', 'h@1/h', 'h@4/f', 'h@10/I', 'c@3', 'c@7/?', 'i@100/3H']
+
+
+def records(stream):
+    return [{key: value for key, value in json.loads(line).items() if key != 'time'}
+            for line in stream.getvalue().splitlines()]
+
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(tempfile.mkdtemp(), 'capture')
+        self.definitions = Definitions(True)
+
+        server, self.modbus = simulated_tcp(self, Simulator())
+        self.device = server.device
+
+    def capture(self, records, cycles, max_gap=0, specs=ACCESSES):
+        registers = describe(parse_accesses(specs, self.definitions, group=False))
+        capture = Capture(self.filename, records, [(self.device, registers)])
+        self.modbus.output = capture
+        self.modbus.tag = self.device
+
+        accesses = parse_accesses(specs, self.definitions, max_gap=max_gap)
+        for _ in range(cycles):
+            self.modbus.perform_accesses(accesses, self.definitions)
+        capture.close()
+
+        return capture, len(accesses)
+
+    def replay(self):
+        stream = io.StringIO()
+        n = replay(self.filename, self.definitions, lambda tagged: RecordOutput(stream, 'jsonl'))
+        return n, records(stream)
+
+    def expected(self, specs=ACCESSES):
+        stream = io.StringIO()
+        self.modbus.output = RecordOutput(stream, 'jsonl')
+        self.modbus.perform_accesses(parse_accesses(specs, self.definitions), self.definitions)
+        self.modbus.output.flush()
+        return records(stream)
+
+    def test_replay(self):
+        _, n = self.capture(20, 2)
+        decoded, values = self.replay()
+        self.assertEqual(2 * n, decoded)
+        self.assertEqual(sorted(2 * self.expected(), key=str), sorted(values, key=str))
+
+    def test_gaps(self):
+        _, n = self.capture(10, 1, max_gap=10)
+        self.assertEqual(3, n)
+        self.assertEqual(sorted(self.expected(), key=str), sorted(self.replay()[1], key=str))
+
+    def test_split(self):
+        # read in two requests, of 125 and 75 registers
+        specs = ['i@0/200H']
+        _, n = self.capture(10, 1, specs=specs)
+        self.assertEqual(2, n)
+        values = self.replay()[1]
+        self.assertEqual([0, 125], [value['label'] for value in values])
+        self.assertEqual(self.expected(specs), values)
+
+    def test_ring(self):
+        self.capture(4, 3)
+        decoded, values = self.replay()
+        # the last 4 of the 18 responses, to h@0 and h@1, h@4, h@10 and i@100
+        self.assertEqual(4, decoded)
+        self.assertEqual([0, 1, 4, 10, 100], [value['label'] for value in values])
+        self.assertEqual([100, 101, 102], values[-1]['value'])
+
+    def test_interrupted(self):
+        capture, _ = self.capture(10, 1)
+        with open(self.filename, 'r+b') as f:
+            # the time of the first record, as while it's being overwritten
+            f.seek(capture.start)
+            f.write(bytes(8))
+        self.assertEqual(5, self.replay()[0])
+
+    def test_not_a_capture(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'not a capture file' * 10)
+        with self.assertRaises(ValueError):
+            self.replay()
+
+
+if __name__ == '__main__':
+    unittest.main()
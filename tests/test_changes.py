@@ -0,0 +1,44 @@
+import unittest
+
+from modbus_cli.definitions import Definitions, Deadband, parse_register
+from modbus_cli.output import Changes
+
+
+class TestChanges(unittest.TestCase):
+
+    def test_changes(self):
+        it = Changes(None)
+        self.assertTrue(it.changed('plc', 100, 1))
+        self.assertFalse(it.changed('plc', 100, 1))
+        self.assertTrue(it.changed('other plc', 100, 1))
+        self.assertTrue(it.changed('plc', 100, 2))
+        self.assertTrue(it.changed('plc', 101, 'Invalid address'))
+        self.assertFalse(it.changed('plc', 101, 'Invalid address'))
+
+    def test_deadband(self):
+        definitions = Definitions(True)
+        definitions.registers = {
+            'temperature': parse_register('i@0/f')._replace(deadband=Deadband(0.5, False)),
+            'pressure': parse_register('i@2/f')._replace(deadband=Deadband(10, True)),
+        }
+        it = Changes(definitions, Deadband(1, False))
+
+        self.assertTrue(it.changed(None, 'temperature', 20.0))
+        self.assertFalse(it.changed(None, 'temperature', 20.4))
+        self.assertTrue(it.changed(None, 'temperature', 20.6))
+        # compared to the last value reported, not to the last one read
+        self.assertFalse(it.changed(None, 'temperature', 20.2))
+        self.assertTrue(it.changed(None, 'temperature', 20.0))
+
+        self.assertTrue(it.changed(None, 'pressure', 100.0))
+        self.assertFalse(it.changed(None, 'pressure', 109.0))
+        self.assertTrue(it.changed(None, 'pressure', 111.0))
+
+        # default deadband
+        self.assertTrue(it.changed(None, 4, 10))
+        self.assertFalse(it.changed(None, 4, 11))
+        self.assertTrue(it.changed(None, 4, 12))
+
+
+if __name__ == '__main__':
+    unittest.main()
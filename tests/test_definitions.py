@@ -1,8 +1,10 @@
 import unittest
 import logging
 import os
+import shutil
+import tempfile
 
-from modbus_cli.definitions import Definitions
+from modbus_cli.definitions import Definitions, Register, Deadband, parse_register
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -14,15 +16,60 @@ class TestDefinitions(unittest.TestCase):
     def test_parse(self):
         it = Definitions(False)
         it.parse([os.path.join(script_dir, 'simple.modbus')])
-        self.assertEqual({'a_register': 'i@100/4H:a_presenter'}, it.registers)
+        self.assertEqual({'a_register': Register('i', 100, '4H', ':a_presenter'),
+                          'with_deadband': Register('i', 0, 'f', None, Deadband(2.0, True))}, it.registers)
         self.assertEqual({':a_presenter': {0: 'x', 1: 'y'}}, it.presenters)
 
     def test_parse_silent(self):
         it = Definitions(True)
         it.parse([os.path.join(script_dir, 'simple.modbus')])
-        self.assertEqual({'a_register': 'i@100/4H:a_presenter'}, it.registers)
+        self.assertEqual({'a_register': Register('i', 100, '4H', ':a_presenter'),
+                          'with_deadband': Register('i', 0, 'f', None, Deadband(2.0, True))}, it.registers)
         self.assertEqual({':a_presenter': {0: 'x', 1: 'y'}}, it.presenters)
 
+    def test_parse_register(self):
+        self.assertEqual(Register('h', 123, 'H', None), parse_register('123'))
+        self.assertEqual(Register('c', 0x10, 'B', None), parse_register('c@0x10'))
+        self.assertEqual(Register('i', 5, '<Hf', '|LEDS'), parse_register('i@5/<Hf|LEDS'))
+        self.assertEqual(None, parse_register('xxx'))
+        self.assertEqual(None, parse_register('h@1/B'))
+        self.assertEqual(None, parse_register('h@1/Z'))
+
+    def test_match(self):
+        it = Definitions(False)
+        it.registers = {'ai0': 'i@0', 'ai1': 'i@1', 'ai10': 'i@10', 'di0': 'd@0', 'b': 'h@0'}
+
+        self.assertEqual([('ai1', 'i@1')], it.match('ai1'))
+        self.assertEqual([], it.match('ai2'))
+        self.assertEqual(['ai0', 'ai1', 'ai10'], [name for name, _ in it.match('ai*')])
+        self.assertEqual(['ai0', 'ai1'], [name for name, _ in it.match('ai?')])
+        self.assertEqual(['ai0', 'ai10', 'di0'], sorted(name for name, _ in it.match('*0')))
+        self.assertEqual(['ai0', 'di0'], sorted(name for name, _ in it.match('[ad]i0')))
+
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        filename = os.path.join(cache_dir, 'registers.modbus')
+        shutil.copy(os.path.join(script_dir, 'simple.modbus'), filename)
+
+        it = Definitions(False, cache_dir)
+        it.parse([filename])
+        self.assertTrue(os.path.exists(it.cache_path(filename)))
+
+        it = Definitions(False, cache_dir)
+        it.parse_file = None  # must not be needed
+        it.parse([filename])
+        self.assertEqual(Register('i', 100, '4H', ':a_presenter'), it.registers['a_register'])
+        self.assertEqual({':a_presenter': {0: 'x', 1: 'y'}}, it.presenters)
+
+        # changing the file invalidates the cache
+        with open(filename, 'a') as f:
+            f.write('another_register h@1\n')
+
+        it = Definitions(False, cache_dir)
+        it.parse([filename])
+        self.assertEqual(Register('h', 1, 'H', None), it.registers['another_register'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import os
+import logging
+import threading
+import time
+
+import umodbus.exceptions
+
+from modbus_cli.modbus_rtu import ModbusRtu
+from modbus_cli.target import Target, perform_targets
+from modbus_cli.access import Access
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class TestModbusRtu(unittest.TestCase):
+
+    def setUp(self):
+        self.device, slave = os.openpty()
+        self.modbus = ModbusRtu(os.ttyname(slave), 19200, 'n', 1, None, 0.1)
+        self.modbus.connect()
+        os.close(slave)
+
+    def tearDown(self):
+        self.modbus.close()
+        os.close(self.device)
+
+    def test_frame_silence(self):
+        self.assertAlmostEqual(3.5 * 10 / 9600, ModbusRtu('/dev/null', 9600, 'n', 1, None, 1).frame_silence)
+        self.assertAlmostEqual(3.5 * 11 / 9600, ModbusRtu('/dev/null', 9600, 'e', 1, None, 1).frame_silence)
+        self.assertAlmostEqual(0.00175, ModbusRtu('/dev/null', 115200, 'n', 1, None, 1).frame_silence)
+
+    def test_skip_timed_out_slave(self):
+        def answer():
+            # slave 1 never answers, slave 2 does
+            for _ in range(2):
+                request = os.read(self.device, 8)
+                if request[0] == 2:
+                    response = self.modbus.protocol._create_request_adu(2, bytes([3, 2, 0, 42]))
+                    os.write(self.device, response)
+
+        device = threading.Thread(target=answer)
+        device.start()
+
+        first = Target('/dev/ttyX', 1, [Access('h', [0], ['!H'])])
+        second = Target('/dev/ttyX', 2, [Access('h', [0], ['!H'])])
+        for target in (first, second):
+            target.modbus = self.modbus
+
+        self.assertEqual([first], perform_targets([first, second], None))
+        device.join()
+
+        self.assertTrue(first.timed_out)
+        self.assertFalse(second.timed_out)
+        self.assertEqual([(42, )], second.accesses[0].values)
+
+    def test_single_slave_timeout(self):
+        target = Target('/dev/ttyX', 1, [Access('h', [0], ['!H'])])
+        target.modbus = self.modbus
+
+        # nothing else on the bus, it's up to the caller
+        with self.assertRaises(TimeoutError):
+            perform_targets([target], None)
+        self.assertFalse(target.timed_out)
+
+        # unless polling, it might answer next time
+        self.assertEqual([target], perform_targets([target], None, polling=True))
+        self.assertTrue(target.timed_out)
+
+    def respond(self, *frames):
+        request = self.modbus.protocol.read_holding_registers(1, 100, 2)
+        self.modbus.timeout = 5
+        os.write(self.device, b''.join(frames))
+        start = time.monotonic()
+        try:
+            return self.modbus.receive(request)
+        finally:
+            # never waiting for the whole timeout
+            self.assertLess(time.monotonic() - start, 1)
+
+    def response(self, pdu):
+        return self.modbus.protocol._create_request_adu(1, pdu)
+
+    def test_response(self):
+        self.assertEqual([1, 2], self.respond(self.response(bytes([3, 4, 0, 1, 0, 2]))))
+
+    def test_garbage_before_response(self):
+        self.assertEqual([1, 2], self.respond(b'\x00\xff\x01', self.response(bytes([3, 4, 0, 1, 0, 2]))))
+
+    def test_invalid_crc(self):
+        with self.assertRaises(TimeoutError):
+            self.respond(self.response(bytes([3, 4, 0, 1, 0, 2]))[:-1] + b'\x00')
+
+    def test_incomplete(self):
+        with self.assertRaises(TimeoutError):
+            self.respond(self.response(bytes([3, 4, 0, 1, 0, 2]))[:5])
+
+    def test_exception(self):
+        with self.assertRaises(umodbus.exceptions.IllegalDataAddressError):
+            self.respond(self.response(bytes([0x83, 2])))
+
+
+if __name__ == '__main__':
+    unittest.main()
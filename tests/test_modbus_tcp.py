@@ -0,0 +1,114 @@
+import unittest
+import socket
+import struct
+import logging
+
+from modbus_cli.modbus_tcp import ModbusTcp
+from modbus_cli.access import Access
+from modbus_cli.stats import Stats
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def response(request, *words):
+    transaction_id = request[:2]
+    pdu = struct.pack('>BB{}H'.format(len(words)), request[7], 2 * len(words), *words)
+    return transaction_id + struct.pack('>HHB', 0, len(pdu) + 1, request[6]) + pdu
+
+
+class TestModbusTcp(unittest.TestCase):
+
+    def setUp(self):
+        self.modbus = ModbusTcp('localhost', 502, None, 1.0)
+        self.modbus.connection, self.device = socket.socketpair()
+        self.device.settimeout(1.0)
+
+    def tearDown(self):
+        self.modbus.close()
+        self.device.close()
+
+    def test_out_of_order(self):
+        first = self.modbus.send(self.modbus.protocol.read_holding_registers(1, 100, 1))
+        second = self.modbus.send(self.modbus.protocol.read_holding_registers(1, 200, 1))
+        self.assertNotEqual(first[:2], second[:2])
+
+        self.device.sendall(response(second, 2) + response(first, 1))
+
+        self.assertEqual([1], self.modbus.receive(first))
+        self.assertEqual([2], self.modbus.receive(second))
+
+    def test_timeout(self):
+        request = self.modbus.send(self.modbus.protocol.read_holding_registers(1, 100, 1))
+        self.modbus.timeout = 0.01
+
+        with self.assertRaises(OSError):
+            self.modbus.receive(request)
+
+    def test_timeout_in_body(self):
+        self.modbus.stats = stats = Stats()
+        request = self.modbus.send(self.modbus.protocol.read_holding_registers(1, 100, 1))
+        self.modbus.timeout = 0.05
+        self.device.sendall(response(request, 1)[:8])
+
+        with self.assertRaises(TimeoutError):
+            self.modbus.receive(request)
+        self.assertEqual(1, stats.counters[3]['timeouts'])
+
+    def test_window(self):
+        modbus = self.modbus
+        device = self.device
+        in_flight = []
+
+        class Connection:
+            def __init__(self, connection):
+                self.connection = connection
+
+            def sendall(self, request):
+                in_flight.append(len(modbus.sent))
+                self.connection.sendall(request)
+                # transaction ids are assigned sequentially starting from 1
+                device.sendall(response(request, struct.unpack('>H', request[:2])[0]))
+
+            def __getattr__(self, name):
+                return getattr(self.connection, name)
+
+        modbus.connection = Connection(modbus.connection)
+        modbus.window = 2
+
+        accesses = [Access('h', [address], ['!H']) for address in range(3)]
+        modbus.perform_accesses(accesses, None)
+
+        self.assertEqual([1, 2, 2], in_flight)
+        self.assertEqual([[(1, )], [(2, )], [(3, )]], [access.values for access in accesses])
+
+    def test_many_frames_at_once(self):
+        requests = [self.modbus.send(self.modbus.protocol.read_holding_registers(1, n, 1)) for n in range(100)]
+
+        self.device.sendall(b''.join(response(request, n) for n, request in enumerate(requests)))
+
+        for n, request in enumerate(requests):
+            self.assertEqual([n], self.modbus.receive(request))
+        self.assertEqual((0, 0), (self.modbus.start, self.modbus.end))
+
+    def test_partial_frames(self):
+        first = self.modbus.send(self.modbus.protocol.read_holding_registers(1, 100, 1))
+        second = self.modbus.send(self.modbus.protocol.read_holding_registers(1, 200, 1))
+        data = response(first, 1) + response(second, 2)
+
+        self.device.sendall(data[:3])
+        self.device.sendall(data[3:14])
+        self.assertEqual([1], self.modbus.receive(first))
+
+        self.device.sendall(data[14:])
+        self.assertEqual([2], self.modbus.receive(second))
+
+    def test_closed(self):
+        request = self.modbus.send(self.modbus.protocol.read_holding_registers(1, 100, 1))
+        self.device.close()
+
+        with self.assertRaises(ConnectionError):
+            self.modbus.receive(request)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import Mock
+import io
+import json
+
+from modbus_cli.access import Access
+from modbus_cli.output import RecordOutput
+
+
+def performed_access():
+    modbus = Mock()
+    modbus.send = Mock(side_effect=lambda request: request)
+    modbus.protocol.read_holding_registers = Mock(return_value=b'')
+    modbus.receive = Mock(return_value=[0x1234, 0x3fc0, 0x0000])
+
+    access = Access('h', [100, 101], ['!H', '!f'], names=['a', None])
+    access.perform(modbus)
+    return access
+
+
+class TestOutput(unittest.TestCase):
+
+    def test_jsonl(self):
+        stream = io.StringIO()
+        output = RecordOutput(stream, 'jsonl')
+        output.write(performed_access(), None, 'plc')
+        self.assertEqual('', stream.getvalue())
+
+        output.flush()
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([('plc', 'a', [0x1234], 0x1234), ('plc', 101, [0x3fc0, 0], 1.5)],
+                         [(r['device'], r['label'], r['words'], r['value']) for r in records])
+
+    def test_csv(self):
+        stream = io.StringIO()
+        output = RecordOutput(stream, 'csv')
+        output.write(performed_access(), None, 'plc')
+        output.flush()
+        self.assertEqual(['plc,a,4660,4660', 'plc,101,16320 0,1.5'],
+                         [line.split(',', 1)[1] for line in stream.getvalue().splitlines()])
+
+    def test_influx_line(self):
+        stream = io.StringIO()
+        output = RecordOutput(stream, 'influx-line')
+        output.write(performed_access(), None, 'plc 1')
+        output.flush()
+        self.assertEqual(['modbus,device=plc\\ 1,label=a value=4660i,words="4660"',
+                          'modbus,device=plc\\ 1,label=101 value=1.5,words="16320 0"'],
+                         [line.rsplit(' ', 1)[0] for line in stream.getvalue().splitlines()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+import threading
+from unittest.mock import Mock
+
+from modbus import poll
+
+
+class TestPoll(unittest.TestCase):
+
+    def test_count(self):
+        cycle = Mock()
+
+        poll(cycle, 0.001, count=3)
+        self.assertEqual(3, cycle.call_count)
+
+    def test_stop(self):
+        stop = threading.Event()
+        cycle = Mock(side_effect=stop.set)
+
+        poll(cycle, 10, stop=stop)
+        self.assertEqual(1, cycle.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import unittest
+import argparse
+import logging
+import socket
+
+from modbus_cli.access import Access
+from modbus_cli.benchmark import Discard
+from modbus_cli.retry import backoff_delay, CircuitBreaker, MAX_BACKOFF
+from modbus_cli.simulator import Simulator, RtuSimulator, TcpSimulator
+from modbus_cli.target import Target, perform_targets
+from modbus import scan
+
+from simulated import simulated_tcp
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class DropFirst(Simulator):
+    """Doesn't answer the first request"""
+
+    def respond(self, pdu):
+        delay, response = super().respond(pdu)
+        return delay, response if self.requests > 1 else None
+
+
+class Failing:
+    def __init__(self):
+        self.stats = None
+        self.calls = 0
+
+    def perform_accesses(self, accesses, definitions):
+        self.calls += 1
+        raise ConnectionRefusedError('refused')
+
+
+class Errors(Discard):
+    """Counts the values read and the exceptions answered instead"""
+
+    def __init__(self):
+        self.values = 0
+        self.errors = 0
+
+    def write(self, access, definitions, tag=None, timestamp=None):
+        if access.error:
+            self.errors += 1
+        else:
+            self.values += 1
+
+
+def plan():
+    return [Access('h', [address], ['>H']) for address in range(4)]
+
+
+class TestRetry(unittest.TestCase):
+
+    def test_backoff(self):
+        self.assertEqual([0.1, 0.2, 0.4], [backoff_delay(0.1, attempt) for attempt in (1, 2, 3)])
+        self.assertEqual(MAX_BACKOFF, backoff_delay(1, 20))
+
+    def test_breaker(self):
+        breaker = CircuitBreaker(2, 10)
+        self.assertFalse(breaker.failure(0))
+        self.assertTrue(breaker.allow(0))
+        self.assertTrue(breaker.failure(1))
+        self.assertFalse(breaker.allow(5))
+        self.assertTrue(breaker.allow(11))
+        # still failing, down again right away
+        self.assertTrue(breaker.failure(11))
+        self.assertFalse(breaker.allow(12))
+        self.assertTrue(breaker.success())
+        self.assertTrue(breaker.allow(12))
+
+    def tcp(self, simulator, window=None):
+        server, modbus = simulated_tcp(self, simulator, 0.2, window)
+        modbus.retries = 2
+        modbus.backoff = 0.01
+        return server, modbus
+
+    def test_replay_in_flight(self):
+        simulator = DropFirst()
+        _, modbus = self.tcp(simulator, 4)
+        accesses = plan()
+
+        modbus.perform_accesses(accesses, None)
+
+        self.assertEqual([[(0, )], [(1, )], [(2, )], [(3, )]], [access.values for access in accesses])
+        # the whole window was in flight when the first request timed out
+        self.assertEqual(8, simulator.requests)
+
+    def test_reconnect(self):
+        simulator = Simulator()
+        server, modbus = self.tcp(simulator)
+        modbus.perform_accesses(plan(), None)
+
+        for connection in server.connections:
+            connection.shutdown(socket.SHUT_RDWR)
+
+        accesses = plan()
+        modbus.perform_accesses(accesses, None)
+        self.assertEqual([(3, )], accesses[3].values)
+        self.assertEqual(2, len(server.connections))
+
+    def test_give_up(self):
+        simulator = Simulator(drop_rate=1)
+        _, modbus = self.tcp(simulator, 1)
+
+        with self.assertRaises(TimeoutError):
+            modbus.perform_accesses(plan(), None)
+        self.assertEqual(3, simulator.requests)
+        self.assertTrue(modbus.broken)
+
+    def test_rtu(self):
+        simulator = DropFirst()
+        server = RtuSimulator(simulator)
+        self.addCleanup(server.close)
+        modbus = server.connect(0.2)
+        self.addCleanup(modbus.close)
+        modbus.output = Discard()
+        modbus.retries = 1
+        modbus.backoff = 0.01
+
+        accesses = plan()
+        modbus.perform_accesses(accesses, None)
+        self.assertEqual([(0, )], accesses[0].values)
+        self.assertEqual(5, simulator.requests)
+
+    def test_device_down(self):
+        target = Target('192.168.0.10', None, [])
+        target.modbus = Failing()
+        target.breaker = CircuitBreaker(2, 60)
+
+        for _ in range(4):
+            perform_targets([target], None)
+
+        self.assertEqual(2, target.modbus.calls)
+
+    def test_exceptions(self):
+        simulator = Simulator(error_rate=0.3, seed=1)
+        server = TcpSimulator(simulator)
+        self.addCleanup(server.close)
+        args = argparse.Namespace(device=server.device, slave_id=None, timeout=1, window=4, retries=2, backoff=0.01,
+                                  poll=0.001, count=30)
+        output = Errors()
+
+        # the device keeps being polled, the whole plan each cycle
+        self.assertFalse(scan(args, [Target(server.device, None, plan())], None, output))
+        self.assertEqual(120, simulator.requests)
+        self.assertEqual(120, output.values + output.errors)
+        self.assertGreater(output.errors, 0)
+
+    def test_no_breaker(self):
+        target = Target('192.168.0.10', None, [])
+        target.modbus = Failing()
+
+        with self.assertRaises(ConnectionRefusedError):
+            perform_targets([target], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
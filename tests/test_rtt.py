@@ -0,0 +1,91 @@
+import unittest
+import logging
+import os
+import tempfile
+import time
+
+from modbus_cli.access import Access
+from modbus_cli.rtt import Rtt
+from modbus_cli.simulator import Simulator
+from modbus_cli.stats import Stats
+
+from simulated import simulated_tcp
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class TestRtt(unittest.TestCase):
+
+    def test_estimates(self):
+        rtt = Rtt(0.01, 5)
+        self.assertEqual(5, rtt.timeout('a'))
+
+        rtt.sample('a', 0.1)
+        # 0.1 + 4 * 0.05
+        self.assertAlmostEqual(0.3, rtt.timeout('a'))
+
+        for _ in range(50):
+            rtt.sample('a', 0.1)
+        self.assertLess(rtt.timeout('a'), 0.11)
+
+        rtt.sample('b', 0.001)
+        self.assertEqual(0.01, rtt.timeout('b'))
+        rtt.sample('c', 10)
+        self.assertEqual(5, rtt.timeout('c'))
+
+    def test_backoff(self):
+        rtt = Rtt(0.01, 5)
+        rtt.sample('a', 0.1)
+        rtt.timed_out('a')
+        self.assertAlmostEqual(0.6, rtt.timeout('a'))
+        rtt.timed_out('a')
+        self.assertAlmostEqual(1.2, rtt.timeout('a'))
+        rtt.sample('a', 0.1)
+        self.assertLess(rtt.timeout('a'), 0.3)
+
+    def test_persistence(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'cache', 'rtt.json')
+        rtt = Rtt(0.01, 5)
+        rtt.load(filename)
+        rtt.sample('a', 0.1)
+        rtt.save(filename)
+
+        loaded = Rtt(0.01, 5)
+        loaded.load(filename)
+        self.assertAlmostEqual(rtt.timeout('a'), loaded.timeout('a'))
+
+        with open(filename, 'w') as f:
+            f.write('[1, 2]')
+        Rtt(0.01, 5).load(filename)
+
+    def test_transport(self):
+        simulator = Simulator()
+        server, modbus = simulated_tcp(self, simulator)
+        modbus.rtt = Rtt(0.05, 5)
+
+        for _ in range(5):
+            Access('h', [1], ['>H']).perform(modbus)
+        self.assertEqual(['{}/255/3'.format(server.device)], list(modbus.rtt.estimates))
+
+        simulator.drop_rate = 1
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            Access('h', [1], ['>H']).perform(modbus)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_window(self):
+        stats = Stats()
+        server, modbus = simulated_tcp(self, Simulator(latency=0.02), window=16, stats=stats)
+        modbus.rtt = Rtt(0.01, 5)
+
+        for _ in range(10):
+            modbus.perform_accesses([Access('h', [address], ['>H']) for address in range(64)], None)
+
+        self.assertEqual(640, stats.counters[3]['requests'])
+        self.assertEqual(0, stats.counters[3]['timeouts'])
+        # the response time of the device, not of the whole window
+        self.assertLess(modbus.rtt.estimates['{}/255/3'.format(server.device)][0], 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import math
+
+from modbus_cli.access import Access
+from modbus_cli.definitions import Definitions, parse_register
+from modbus_cli.scheduler import Scheduler, scan_periods
+
+
+def addresses(plan):
+    return [address for access in plan for address in access.addresses]
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_scan_periods(self):
+        definitions = Definitions(True)
+        definitions.registers = {
+            'alarm': parse_register('100')._replace(scan=0.1),
+            'plate': parse_register('200')._replace(scan=math.inf),
+            'temperature': parse_register('300'),
+        }
+        accesses = [Access('h', [definitions.registers[name].address], ['!H'], names=[name])
+                    for name in definitions.registers]
+        accesses.append(Access('h', [400], ['!H']))
+
+        periods = scan_periods(accesses, definitions, 1.0, [('4*', 5.0)])
+        self.assertEqual({0.1: ['alarm'], math.inf: ['plate'], 1.0: ['temperature'], 5.0: [None]},
+                         {period: [a.names[0] for a in xs] for period, xs in periods.items()})
+
+    def test_tick(self):
+        periods = {
+            0.1: [Access('h', [0], ['!H']), Access('h', [1], ['!H'])],
+            0.2: [Access('h', [2], ['!H'])],
+            math.inf: [Access('h', [3], ['!H'])],
+        }
+        it = Scheduler(periods, 0.1)
+
+        due, plan = it.tick(0.0)
+        self.assertEqual(1, len(plan))
+        self.assertEqual([0, 1, 2, 3], addresses(plan))
+
+        fast = it.tick(0.1)[1]
+        self.assertEqual([0, 1], addresses(fast))
+        self.assertEqual([0, 1, 2], addresses(it.tick(0.2)[1]))
+
+        # the same classes due, the same plan
+        self.assertIs(fast, it.tick(0.3)[1])
+
+        # the originals are never modified by grouping
+        self.assertEqual([[0], [1]], [a.addresses for a in periods[0.1]])
+
+    def test_deadline_misses(self):
+        it = Scheduler({1.0: [Access('h', [0], ['!H'])]}, 1.0)
+        it.tick(0.0)
+        it.tick(3.5)
+        self.assertEqual(2, it.classes[0].misses)
+        self.assertEqual(4.0, it.classes[0].next_due)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+
+import umodbus.exceptions
+
+from modbus_cli.definitions import Definitions
+from modbus_cli.server import Server, query
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class FakeModbus:
+    """Reads of holding registers return the address, reads bridging h@5 and writes to it fail"""
+
+    def __init__(self):
+        self.slave_id = 1
+        self.stats = None
+        self.closed = False
+        self.slave_ids = []
+        self.requests = 0
+
+    def perform_accesses(self, accesses, definitions):
+        self.slave_ids.append(self.slave_id)
+        for access in accesses:
+            self.requests += 1
+            if access.write:
+                access.error = umodbus.exceptions.IllegalDataAddressError() if 5 in access.addresses else None
+                continue
+            gaps = list(access.gaps())
+            if 5 in gaps:
+                self.illegal_gaps.update((access.modbus_type, address) for address in gaps)
+                access.values = None
+                continue
+            access.values = [(address,) for address in access.addresses]
+            self.output.write(access, definitions)
+
+    def close(self):
+        self.closed = True
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+        self.connecting = threading.Event()
+        self.connected = threading.Event()
+
+        def connect(device):
+            if device == 'broken':
+                raise ConnectionRefusedError('refused')
+            if device == 'invalid':
+                raise ValueError('Invalid device')
+            if device == 'slow':
+                self.connecting.set()
+                self.connected.wait(5)
+            self.connections.append(FakeModbus())
+            return self.connections[-1]
+
+        self.path = os.path.join(tempfile.mkdtemp(), 'modbus.sock')
+        self.server = Server(self.path, connect, Definitions(silent=True))
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_kept_open(self):
+        self.assertEqual('3: 3 0x3\n4: 4 0x4\n', query(self.path, 'device h@3 h@4\n'))
+        self.assertEqual('5: 5 0x5\n', query(self.path, '-s 7 device h@5\n'))
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual([1, 7], self.connections[0].slave_ids)
+
+    def test_illegal_gaps_kept(self):
+        for _ in range(2):
+            self.assertEqual('3: 3 0x3\n6: 6 0x6\n', query(self.path, '--max-gap 5 device h@3 h@6\n'))
+        # bridging the gap failed and was retried only the first time
+        self.assertEqual(3 + 2, self.connections[0].requests)
+
+    def test_slow_connect(self):
+        slow = threading.Thread(target=query, args=(self.path, 'slow h@3\n'))
+        slow.start()
+        try:
+            self.assertTrue(self.connecting.wait(5))
+            start = time.monotonic()
+            self.assertEqual('4: 4 0x4\n', query(self.path, 'device h@4\n'))
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            self.connected.set()
+            slow.join()
+
+    def test_format(self):
+        self.assertIn('"value": 3', query(self.path, '-f jsonl device h@3\n'))
+
+    def test_errors(self):
+        self.assertTrue(query(self.path, 'device\n').startswith('error: '))
+        self.assertEqual('error: refused\n', query(self.path, 'broken h@3\n'))
+        self.assertEqual('error: Invalid device\n', query(self.path, 'invalid h@3\n'))
+        self.assertEqual('', query(self.path, 'device h@6=1\n'))
+        self.assertTrue(query(self.path, 'device h@5=1\n').startswith("error: h@5/['!H']=['1'] rejected: "))
+
+    def test_permissions(self):
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    def test_not_a_socket(self):
+        path = os.path.join(os.path.dirname(self.path), 'notes.txt')
+        with open(path, 'w') as f:
+            f.write('notes')
+        with self.assertRaises(ValueError):
+            Server(path, None, None)
+        with open(path) as f:
+            self.assertEqual('notes', f.read())
+
+    def test_stale_socket(self):
+        self.server.shutdown()
+        self.server.socket.close()
+        # the socket file is left behind, as by a server that was killed
+        self.assertTrue(os.path.exists(self.path))
+        self.server = Server(self.path, None, None)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.assertTrue(query(self.path, 'device\n').startswith('error: '))
+
+    def test_close(self):
+        query(self.path, 'device h@3\n')
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertTrue(self.connections[0].closed)
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import logging
+
+import umodbus.exceptions
+
+from modbus_cli.access import Access
+from modbus_cli.benchmark import benchmark, Discard
+from modbus_cli.simulator import Simulator, RtuSimulator
+
+from simulated import simulated_tcp
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def accesses():
+    return [
+        Access('h', [10, 11], ['>H', '>h'], ['7', '-2']),
+        Access('h', [10, 11, 12], ['>H', '>h', '>H']),
+        Access('c', [3, 4], ['!B', '!B'], ['1', '1']),
+        Access('c', [2, 3, 4, 5], ['!B', '!B', '!B', '!B']),
+        Access('i', [100], ['>f']),
+        Access('d', [7], ['!B']),
+    ]
+
+
+class TestSimulator(unittest.TestCase):
+
+    def perform(self, modbus):
+        modbus.output = Discard()
+        plan = accesses()
+        modbus.perform_accesses(plan, None)
+        self.assertEqual([(7, ), (-2, ), (12, )], plan[1].values)
+        self.assertEqual([(0, ), (1, ), (1, ), (1, )], plan[3].values)
+        self.assertEqual(2, len(plan[4].words))
+        self.assertEqual([(1, )], plan[5].values)
+
+    def test_tcp(self):
+        _, modbus = simulated_tcp(self, Simulator(), 1, 2)
+        self.perform(modbus)
+
+    def test_rtu(self):
+        server = RtuSimulator(Simulator(), slave_id=1)
+        self.addCleanup(server.close)
+        modbus = server.connect(1)
+        self.addCleanup(modbus.close)
+        self.perform(modbus)
+
+    def test_faults(self):
+        simulator = Simulator(seed=1)
+        simulator.illegal.add(('h', 5))
+        _, modbus = simulated_tcp(self, simulator, 0.2)
+
+        access = Access('h', [5], ['>H'])
+        access.perform(modbus)
+        self.assertEqual(('Invalid address', ), access.values)
+
+        simulator.error_rate = 1
+        access = Access('h', [6], ['>H'])
+        access.perform(modbus)
+        self.assertIsInstance(access.error, umodbus.exceptions.ServerDeviceFailureError)
+        self.assertEqual(('An unrecoverable error occurred.', ), access.values)
+
+        simulator.error_rate = 0
+        simulator.drop_rate = 1
+        with self.assertRaises(TimeoutError):
+            Access('h', [6], ['>H']).perform(modbus)
+
+    def test_benchmark(self):
+        rows = list(benchmark(sizes=(2, ), windows=(1, 2), cycles=2))
+        self.assertEqual([('tcp', 1), ('tcp', 2), ('rtu', 1)], [(row['transport'], row['window']) for row in rows])
+        for row in rows:
+            self.assertGreater(row['registers/s'], row['requests/s'])
+            self.assertLessEqual(row['p50 ms'], row['p99 ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import json
+import logging
+import os
+import tempfile
+
+from modbus_cli.access import Access
+from modbus_cli.simulator import Simulator
+from modbus_cli.stats import Stats
+
+from simulated import simulated_tcp
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class TestStats(unittest.TestCase):
+
+    def test_add_time(self):
+        stats = Stats()
+        start = stats.add_time('send', 0)
+        stats.add_time('send', start)
+        self.assertEqual(2, stats.timers['send'][0])
+        self.assertEqual(start, stats.timers['send'][2])
+        self.assertEqual(['send'], list(stats.as_dict()['phases']))
+
+    def test_transport(self):
+        simulator = Simulator()
+        simulator.illegal.add(('h', 7))
+        stats = Stats()
+        _, modbus = simulated_tcp(self, simulator, 0.2, stats=stats)
+
+        modbus.perform_accesses([Access('h', [5], ['>H']), Access('h', [7], ['>H']),
+                                 Access('h', [8], ['>H'], ['1'])], None)
+        simulator.drop_rate = 1
+        with self.assertRaises(TimeoutError):
+            modbus.perform_accesses([Access('i', [1], ['>H'])], None)
+
+        self.assertEqual(dict(requests=2, retries=0, timeouts=0, exceptions=1), {
+            counter: stats.counters[3][counter] for counter in ('requests', 'retries', 'timeouts', 'exceptions')})
+        self.assertEqual(24, stats.counters[3]['bytes sent'])
+        self.assertEqual(1, stats.counters[6]['requests'])
+        self.assertEqual(1, stats.counters[4]['timeouts'])
+        phases = stats.as_dict()['phases']
+        for phase in ('dns', 'connect', 'send', 'wait', 'receive', 'decode', 'output'):
+            self.assertIn(phase, phases)
+        self.assertEqual(2, phases['output']['count'])
+
+        filename = os.path.join(tempfile.mkdtemp(), 'stats.json')
+        stats.dump(filename)
+        with open(filename) as f:
+            self.assertEqual(1, json.load(f)['functions']['6']['requests'])
+
+        stats.report()
+
+
+if __name__ == '__main__':
+    unittest.main()
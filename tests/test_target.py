@@ -0,0 +1,83 @@
+import unittest
+import argparse
+import io
+import json
+import logging
+import os
+import socket
+import time
+
+from modbus_cli.access import parse_accesses
+from modbus_cli.output import RecordOutput
+from modbus_cli.simulator import Simulator, TcpSimulator
+from modbus_cli.target import parse_targets, perform_targets, Target
+from modbus import scan_groups
+
+from simulated import simulated_tcp
+
+logging.basicConfig(level=logging.DEBUG)
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestTarget(unittest.TestCase):
+
+    def test_parse(self):
+        it = parse_targets(os.path.join(script_dir, 'simple.targets'))
+        self.assertEqual([('192.168.0.10', None, ['ai*']), ('/dev/ttyUSB0', 3, ['c@0', 'c@1'])], it)
+
+    def test_tag(self):
+        self.assertEqual('192.168.0.10', Target('192.168.0.10', None, []).tag)
+        self.assertEqual('/dev/ttyUSB0/3', Target('/dev/ttyUSB0', 3, []).tag)
+        self.assertTrue(Target('/dev/ttyUSB0', 3, []).serial)
+
+    def test_rejected_write(self):
+        simulator = Simulator()
+        simulator.illegal.add(('h', 5))
+        server, modbus = simulated_tcp(self, simulator)
+
+        target = Target(server.device, modbus.slave_id, parse_accesses(['h@5=3', 'h@7=4'], None))
+        target.modbus = modbus
+        self.assertEqual([target], perform_targets([target], None))
+        self.assertEqual([False, True], [access.error is None for access in target.accesses])
+
+        target.accesses = parse_accesses(['h@7=4'], None)
+        self.assertEqual([], perform_targets([target], None))
+
+    def scan(self, devices):
+        args = argparse.Namespace(slave_id=None, timeout=1, window=None, retries=0, backoff=0.1, poll=None,
+                                  count=None)
+        groups = [[Target(device, None, parse_accesses(['h@3'], None))] for device in devices]
+        stream = io.StringIO()
+        ok = scan_groups(args, groups, None, RecordOutput(stream, 'jsonl'), True)
+        return ok, [json.loads(line)['device'] for line in stream.getvalue().splitlines()]
+
+    def test_concurrent(self):
+        devices = []
+        for _ in range(2):
+            server = TcpSimulator(Simulator(latency=0.2))
+            self.addCleanup(server.close)
+            devices.append(server.device)
+
+        start = time.monotonic()
+        ok, tags = self.scan(devices)
+        # about the latency of a single device, not of both
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertTrue(ok)
+        self.assertEqual(sorted(devices), sorted(tags))
+
+    def test_device_failed(self):
+        server = TcpSimulator(Simulator())
+        self.addCleanup(server.close)
+        with socket.socket() as s:
+            # nothing listening there once it's closed
+            s.bind(('127.0.0.1', 0))
+            refused = '127.0.0.1:{}'.format(s.getsockname()[1])
+
+        ok, tags = self.scan([server.device, refused])
+        self.assertFalse(ok)
+        self.assertEqual([server.device], tags)
+
+
+if __name__ == '__main__':
+    unittest.main()